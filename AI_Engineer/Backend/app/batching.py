@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchedLLM:
+    """Concurrency cap in front of `chat.completions.create`.
+    OpenRouter has no batch endpoint, so requests are dispatched immediately (no collection
+    window to wait out); only the number of in-flight calls is bounded."""
+
+    def __init__(self, client, max_parallel: int = 16):
+        self.client = client
+        self.max_parallel = max_parallel
+        self._semaphore = None
+
+    def start(self):
+        """Create the semaphore on the running loop (call from the FastAPI startup event)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel)
+            logger.info(f"LLM dispatcher started (max_parallel={self.max_parallel})")
+
+    async def stop(self):
+        self._semaphore = None
+
+    async def create(self, **kwargs):
+        """Send a completion request, waiting for a free slot if max_parallel calls are in flight"""
+        semaphore = self._semaphore
+        if semaphore is None:
+            # Not started (e.g. standalone scripts), call directly
+            return await self.client.chat.completions.create(**kwargs)
+
+        async with semaphore:
+            return await self.client.chat.completions.create(**kwargs)
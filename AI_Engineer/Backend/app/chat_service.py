@@ -1,69 +1,116 @@
-# from app.gemini_client import gemini_client (Legacy)
 from app.llm_client import llm_client
 from app.memory import memory
+import re
+import orjson
 import time
 import logging
+from typing import AsyncIterator
 
 logger = logging.getLogger(__name__)
 
-async def process_chat(
-    ticker: str,
-    message: str,
-    technical_data: dict = None,
-    forecast_screenshot: str = None
-) -> dict:
-    """Main chat processing logic with hybrid approach"""
-    
-    start_time = time.time()
+# Forecast-related keywords, matched case-insensitively in one pass
+FORECAST_RE = re.compile(r"prediksi|forecast|ramalan|masa depan|future|projection", re.IGNORECASE)
+
+async def _prepare_context(ticker: str, message: str, forecast_screenshot: str = None):
+    """Run vision (if needed) and fetch history. Returns (vision_analysis, mode, history)."""
     
     # Detect if this is a forecast-related question
-    forecast_keywords = ["prediksi", "forecast", "ramalan", "masa depan", "future", "projection"]
-    is_forecast_question = any(
-        keyword in message.lower() 
-        for keyword in forecast_keywords
-    )
+    is_forecast_question = bool(FORECAST_RE.search(message))
     
     vision_analysis = None
     mode = "json"
     
     # Use Vision mode if forecast question AND screenshot provided
     if is_forecast_question and forecast_screenshot:
-        logger.info(f"Using VISION mode for: {message[:50]}...")
+        logger.info("Using VISION mode for: %.50s...", message)
         mode = "vision"
         try:
             # SWITCH: Use OpenRouter (Mistral) for Vision
+            # (follow-ups on the same chart hit llm_client's image-hash cache)
             vision_analysis = await llm_client.analyze_chart(forecast_screenshot)
         except Exception as e:
             logger.error(f"Vision analysis failed: {e}")
             # Fallback to JSON mode
             mode = "json_fallback"
     else:
-        logger.info(f"Using JSON mode for: {message[:50]}...")
+        logger.info("Using JSON mode for: %.50s...", message)
     
-    # Get conversation history for context
-    history = memory.get_history(ticker)
+    # Get the past exchanges most relevant to this question
+    history = await memory.get_history(ticker, message)
+    
+    return vision_analysis, mode, history
+
+async def process_chat(
+    ticker: str,
+    message: str,
+    technical_data: dict = None,
+    forecast_screenshot: str = None,
+    use_cache: bool = True
+) -> dict:
+    """Main chat processing logic with hybrid approach"""
+    
+    start_time = time.time()
+    
+    vision_analysis, mode, history = await _prepare_context(ticker, message, forecast_screenshot)
     
     # Generate answer using DeepSeek (OpenRouter)
     try:
         response = await llm_client.answer_question(
             question=message,
+            ticker=ticker,
             technical_data=technical_data,
             vision_analysis=vision_analysis,
-            history=history
+            history=history,
+            use_cache=use_cache
         )
     except Exception as e:
         logger.error(f"Answer generation failed: {e}")
         response = f"Maaf, terjadi error saat memproses pertanyaan: {str(e)}"
     
     # Save exchange to memory
-    memory.add_exchange(ticker, message, response)
+    await memory.add_exchange(ticker, message, response)
     
     processing_time = time.time() - start_time
     
-    logger.info(f"Chat processed in {processing_time:.2f}s ({mode} mode)")
+    logger.info("Chat processed in %.2fs (%s mode)", processing_time, mode)
     
     return {
         "response": response,
         "mode": mode,
         "processing_time": round(processing_time, 2)
     }
+
+async def process_chat_stream(
+    ticker: str,
+    message: str,
+    technical_data: dict = None,
+    forecast_screenshot: str = None,
+    use_cache: bool = True
+) -> AsyncIterator[bytes]:
+    """Same pipeline as process_chat, emitted as Server-Sent Events.
+    Each event is {"delta": text}; the last one is {"done": true, "mode": ..., "processing_time": ...}."""
+    
+    start_time = time.time()
+    
+    vision_analysis, mode, history = await _prepare_context(ticker, message, forecast_screenshot)
+    
+    parts = []
+    async for delta in llm_client.answer_question_stream(
+        question=message,
+        ticker=ticker,
+        technical_data=technical_data,
+        vision_analysis=vision_analysis,
+        history=history,
+        use_cache=use_cache
+    ):
+        parts.append(delta)
+        yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+    
+    # Save full exchange to memory once the stream completes
+    await memory.add_exchange(ticker, message, "".join(parts))
+    
+    processing_time = time.time() - start_time
+    
+    logger.info("Chat streamed in %.2fs (%s mode)", processing_time, mode)
+    
+    yield b"data: " + orjson.dumps({"done": True, "mode": mode, "processing_time": round(processing_time, 2)}) + b"\n\n"
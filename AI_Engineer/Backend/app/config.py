@@ -1,7 +1,10 @@
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True)
+    
     # API Keys
     google_api_key: Optional[str] = None
     tavily_api_key: Optional[str] = None
@@ -15,6 +18,7 @@ class Settings(BaseSettings):
     openrouter_api_key: Optional[str] = None
     openrouter_model_vision: str = "mistralai/ministral-3b-2512"
     openrouter_model_chat: str = "deepseek/deepseek-v3.2"
+    openrouter_max_parallel: int = 16  # Max in-flight completion calls per worker
     
     # Stock API
     stock_api_url: str = "http://localhost:8002"
@@ -25,12 +29,21 @@ class Settings(BaseSettings):
     
     # Memory
     max_messages: int = 20
+    redis_url: Optional[str] = None  # e.g. redis://localhost:6379/0, shared across workers
     
-    # ChromaDB
+    # ChromaDB (local persistent store is single-process; set CHROMA_HOST for multiple workers)
     chroma_persist_dir: str = "./chroma_db"
+    chroma_host: Optional[str] = None  # Chroma HTTP server, shared across workers
+    chroma_port: int = 8000
     
-    class Config:
-        env_file = ".env"
-        extra = "ignore"
+    # Semantic Cache
+    embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    semantic_cache_threshold: float = 0.15  # Max cosine distance for a hit
+    semantic_cache_ttl: int = 86400  # Seconds
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Parse .env and validate once per process"""
+    return Settings()
 
-settings = Settings()
+settings = get_settings()
@@ -0,0 +1,85 @@
+import os
+import hashlib
+import threading
+import logging
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+class Embedder:
+    """Local sentence embedding model (MiniLM, 384-dim) loaded on first use"""
+
+    def __init__(self, model_name: str, cache_dir: str = None):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self.available = SentenceTransformer is not None
+
+        # Disk tier: float32 vectors survive restarts (1536 bytes per 384-dim vector)
+        self.disk_cache = None
+        if diskcache is not None and cache_dir:
+            try:
+                self.disk_cache = diskcache.Cache(cache_dir, eviction_policy="least-recently-used")
+            except Exception as e:
+                logger.warning(f"Embedding disk cache unavailable: {e}")
+
+        if not self.available:
+            logger.warning("sentence-transformers not installed. Embeddings disabled.")
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                logger.info(f"Loading embedding model {self.model_name}...")
+                self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    def encode(self, text: str) -> np.ndarray:
+        """Encode text without caching (raises on failure)"""
+        model = self._model or self._load()
+        return model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def embed(self, text: str) -> Optional[List[float]]:
+        """Embed text into a normalized vector (blocking, run in threadpool)"""
+        if not self.available:
+            return None
+        try:
+            return list(_embed_text(text))
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return None
+
+# Create singleton
+embedder = Embedder(
+    settings.embedding_model,
+    cache_dir=os.path.join(settings.chroma_persist_dir, "embed")
+)
+
+
+@lru_cache(maxsize=1000)
+def _embed_text(text: str) -> Tuple[float, ...]:
+    """Memory LRU -> disk cache -> model. Failures raise, so they are never cached."""
+    key = hashlib.sha256(text.encode()).hexdigest()
+
+    if embedder.disk_cache is not None:
+        blob = embedder.disk_cache.get(key)
+        if blob is not None:
+            return tuple(np.frombuffer(blob, dtype=np.float32).tolist())
+
+    vector = embedder.encode(text)
+    if embedder.disk_cache is not None:
+        embedder.disk_cache.set(key, vector.tobytes())
+    return tuple(vector.tolist())
@@ -0,0 +1,19 @@
+from collections import defaultdict
+
+# (technical_data key, line template) in prompt order
+_FIELDS = (
+    ("rsi", "- RSI: {current} (Signal: {signal})"),
+    ("macd", "- MACD Signal: {signal}"),
+    ("drawdown", "- Maximum Drawdown: {max_drawdown}%"),
+    ("cumulative_returns", "- Total Return: {total_return}%"),
+    ("moving_averages", "- MA20: {ma20}, MA50: {ma50}"),
+)
+
+def format_technical(data: dict) -> str:
+    """Format technical data for LLM context (missing fields render as N/A)"""
+    lines = [
+        tmpl.format_map(defaultdict(lambda: "N/A", data[key]))
+        for key, tmpl in _FIELDS
+        if data.get(key)
+    ]
+    return "\n".join(lines) if lines else "No technical data available"
@@ -1,9 +1,73 @@
 from openai import AsyncOpenAI
+from itertools import islice
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from types import MappingProxyType
+from typing import AsyncIterator
+from starlette.concurrency import run_in_threadpool
+import io
+import base64
+import asyncio
+import httpx
 import logging
 from app.config import settings
+from app.semantic_cache import semantic_cache
+from app.batching import BatchedLLM
+from app.formatting import format_technical
 
 logger = logging.getLogger(__name__)
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# System prompt shared by every chat request (kept byte-identical for prefix caching)
+STATIC_PREFIX = "You are a professional stock analysis AI assistant. Answer in Bahasa Indonesia."
+
+# Static OpenRouter request bodies (read-only, shared across calls)
+REASONING_BODY = MappingProxyType({"reasoning": {"enabled": True}})
+WEB_SEARCH_BODY = MappingProxyType({"plugins": [{"id": "web", "max_results": 3}]})
+
+@lru_cache(maxsize=1)
+def _load_encoder():
+    """(BPE encoder, STATIC_PREFIX token count) for prompt token accounting (debug logging only).
+    Loaded on the first DEBUG prompt log, so workers that never log at DEBUG don't hold the
+    BPE table. The encoding file is fetched on first use, so a failure only disables the accounting."""
+    try:
+        import tiktoken
+        encoder = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken encoding unavailable: %s", e)
+        return None, 0
+    # The prefix never changes, so it is tokenized once
+    return encoder, len(encoder.encode(STATIC_PREFIX))
+
+VISION_CACHE_SIZE = 32
+VISION_ERROR_PREFIX = "Error analyzing chart"
+VISION_MAX_EDGE = 512  # Longest edge sent to the vision model (fewer image tokens)
+
+@lru_cache(maxsize=64)
+def _decode_b64(data: str) -> bytes:
+    return base64.b64decode(data)
+
+def _downscale_image(image_key: str, image_data: str, image_url: str) -> str:
+    """Resize to VISION_MAX_EDGE and re-encode as PNG data URL (original URL if not needed)"""
+    if Image is None:
+        return image_url
+    try:
+        img = Image.open(io.BytesIO(_decode_b64(image_data)))
+        if max(img.size) <= VISION_MAX_EDGE:
+            return image_url
+        img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG", optimize=True)
+        return f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode()}"
+    except Exception as e:
+        logger.warning(f"Image downscale failed for {image_key}: {e}")
+        return image_url
+
 class LLMClient:
     def __init__(self):
         self.api_key = settings.openrouter_api_key
@@ -16,27 +80,61 @@ class LLMClient:
             # Prevent startup crash by setting dummy key. Calls will fail later if not set.
             self.api_key = "setup_needed"
 
+        # Larger keepalive pool + HTTP/2 so concurrent batched calls share connections
         self.client = AsyncOpenAI(
             api_key=self.api_key,
             base_url=self.base_url,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                http2=True,
+                timeout=30.0
+            )
         )
+        # Concurrent requests are coalesced before hitting OpenRouter (started on app startup)
+        self.batcher = BatchedLLM(self.client, max_parallel=settings.openrouter_max_parallel)
+        # OpenRouter attribution headers, built once and shared by every call
+        self._extra_headers = MappingProxyType({
+            "HTTP-Referer": settings.stock_api_url, # Optional
+            "X-Title": "Stock Analysis AI", # Optional
+        })
+        # image hash -> vision analysis (LRU)
+        self._vision_cache: OrderedDict = OrderedDict()
         logger.info(f"LLM Client initialized (Vision: {self.vision_model})")
 
+    async def warmup(self):
+        """Open the TLS connection to OpenRouter ahead of the first user request"""
+        try:
+            await asyncio.wait_for(self.client.models.list(), timeout=5.0)
+            logger.info("OpenRouter connection warmed up")
+        except Exception as e:
+            logger.warning(f"OpenRouter warmup failed (will connect lazily): {e}")
+
+    async def close(self):
+        await self.client.close()
+
     async def analyze_chart(self, image_base64: str) -> str:
         """Vision analysis using OpenRouter"""
         try:
-            # Clean base64 string if it contains header
+            # Split data URL header ("data:image/png;base64,...") from the payload
             if "," in image_base64:
                 image_data = image_base64.split(",")[1]
-                # Re-add header if it was stripped or just use the clean base64?
                 # OpenAI usually expects a data URL for 'image_url' input type
-                # format: "data:image/jpeg;base64,{base64_string}"
                 # If input ALREADY has header, use it.
                 image_url = image_base64
             else:
                 # Assuming PNG if no header provided, or generic
+                image_data = image_base64
                 image_url = f"data:image/png;base64,{image_base64}"
 
+            # Same chart analyzed recently? Skip the vision call
+            image_key = blake2b(_decode_b64(image_data), digest_size=16).hexdigest()
+            cached = await self._get_cached_vision(image_key)
+            if cached is not None:
+                logger.info("⚡ Vision cache hit")
+                return cached
+
+            image_url = await run_in_threadpool(_downscale_image, image_key, image_data, image_url)
+
             prompt = """Analyze this stock forecast chart. Identify:
 1. Trend direction (upward/downward/sideways)
 2. Confidence band width - are bands widening (low confidence) or tight (high confidence)?
@@ -45,9 +143,9 @@ class LLMClient:
 
 Be concise and focus on actionable insights."""
 
-            logger.info(f"Sending vision request to {self.vision_model}...")
+            logger.info("Sending vision request to %s...", self.vision_model)
 
-            response = await self.client.chat.completions.create(
+            response = await self.batcher.create(
                 model=self.vision_model,
                 messages=[
                     {
@@ -66,53 +164,66 @@ Be concise and focus on actionable insights."""
                         ]
                     }
                 ],
-                # OpenRouter specific headers can be handled via default_headers if needed, 
-                # but standard OpenAI SDK usually works fine.
-                extra_headers={
-                    "HTTP-Referer": settings.stock_api_url, # Optional
-                    "X-Title": "Stock Analysis AI", # Optional
-                }
+                extra_headers=self._extra_headers
             )
             
             result = response.choices[0].message.content
+            if result:
+                self._remember_vision(image_key, result)
+                await run_in_threadpool(semantic_cache.store_vision, image_key, result)
+
             logger.info("Vision analysis completed successfully")
             return result
 
         except Exception as e:
             logger.error(f"Vision analysis error (OpenRouter): {e}")
-            return f"Error analyzing chart: {str(e)}"
+            return f"{VISION_ERROR_PREFIX}: {str(e)}"
+
+    async def _get_cached_vision(self, image_key: str):
+        """Memory LRU first, then the disk/Redis cache shared with chat responses (in the threadpool)"""
+        if image_key in self._vision_cache:
+            self._vision_cache.move_to_end(image_key)
+            return self._vision_cache[image_key]
+        result = await run_in_threadpool(semantic_cache.get_vision, image_key)
+        if result is not None:
+            self._remember_vision(image_key, result)
+        return result
+
+    def _remember_vision(self, image_key: str, result: str):
+        self._vision_cache[image_key] = result
+        if len(self._vision_cache) > VISION_CACHE_SIZE:
+            self._vision_cache.popitem(last=False)
 
     async def answer_question(
         self, 
         question: str,
+        ticker: str = "",
         technical_data: dict = None,
         vision_analysis: str = None,
-        news_context: str = None, 
-        history: list = []
+        news_context: str = None,
+        history: list = [],
+        use_cache: bool = True
     ) -> str:
         """Generate answer using DeepSeek (Reasoning) via OpenRouter"""
         try:
-            logger.info(f"Generating answer with {self.chat_model}...")
-            
-            # Build context (Similar to previous logic)
-            context = self._build_context(technical_data, vision_analysis, news_context, history)
-            
-            messages = [
-                {"role": "system", "content": context},
-                {"role": "user", "content": question}
-            ]
+            # Response cache: same or near-duplicate question on the same context skips the LLM
+            use_cache = use_cache and semantic_cache.enabled
+            if use_cache:
+                context_key = semantic_cache.context_key(ticker, technical_data, vision_analysis, news_context, history)
+                cached, embedding = await run_in_threadpool(semantic_cache.lookup, question, context_key, ticker)
+                if cached is not None:
+                    return cached
+
+            logger.info("Generating answer with %s...", self.chat_model)
+
+            messages = self._build_messages(question, technical_data, vision_analysis, news_context, history)
             
             # Using extra_body to pass 'reasoning' parameter
-            response = await self.client.chat.completions.create(
+            response = await self.batcher.create(
                 model=self.chat_model,
                 messages=messages,
-                extra_body={
-                    "reasoning": {"enabled": True} 
-                },
-                extra_headers={
-                    "HTTP-Referer": settings.stock_api_url,
-                    "X-Title": "Stock Analysis AI",
-                }
+                extra_body=REASONING_BODY,
+                extra_headers=self._extra_headers
             )
             
             # Extract content. 
@@ -120,7 +231,10 @@ Be concise and focus on actionable insights."""
             # change the return type to dict or handle it differently.
             # For now, returning just the content as per original contract.
             result = response.choices[0].message.content
-            
+
+            if use_cache and result:
+                await run_in_threadpool(semantic_cache.store, question, context_key, ticker, result, embedding)
+
             logger.info("Answer generated successfully")
             return result
             
@@ -128,10 +242,61 @@ Be concise and focus on actionable insights."""
             logger.error(f"Answer generation error (OpenRouter): {e}")
             return f"Maaf, terjadi error: {str(e)}"
 
+    async def answer_question_stream(
+        self,
+        question: str,
+        ticker: str = "",
+        technical_data: dict = None,
+        vision_analysis: str = None,
+        news_context: str = None,
+        history: list = [],
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """Stream the answer token-by-token (same prompt and cache as answer_question)"""
+        try:
+            use_cache = use_cache and semantic_cache.enabled
+            if use_cache:
+                context_key = semantic_cache.context_key(ticker, technical_data, vision_analysis, news_context, history)
+                cached, embedding = await run_in_threadpool(semantic_cache.lookup, question, context_key, ticker)
+                if cached is not None:
+                    yield cached
+                    return
+
+            logger.info("Streaming answer with %s...", self.chat_model)
+
+            messages = self._build_messages(question, technical_data, vision_analysis, news_context, history)
+
+            stream = await self.client.chat.completions.create(
+                model=self.chat_model,
+                messages=messages,
+                stream=True,
+                extra_body=REASONING_BODY,
+                extra_headers=self._extra_headers
+            )
+
+            parts = []
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+            result = "".join(parts)
+            if use_cache and result:
+                await run_in_threadpool(semantic_cache.store, question, context_key, ticker, result, embedding)
+
+            logger.info("Answer stream completed")
+
+        except Exception as e:
+            logger.error(f"Answer stream error (OpenRouter): {e}")
+            yield f"Maaf, terjadi error: {str(e)}"
+
     async def generate_market_report(self, ticker: str) -> str:
         """Fetch real-time market news using OpenRouter Web Plugin"""
         try:
-            logger.info(f"Generating market report for {ticker}...")
+            logger.info("Generating market report for %s...", ticker)
             
             prompt = f"""
             Find the latest breaking news for {ticker} stock from the last 24 hours.
@@ -149,13 +314,8 @@ Be concise and focus on actionable insights."""
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
-                extra_body={
-                    "plugins": [{"id": "web", "max_results": 3}]
-                },
-                extra_headers={
-                    "HTTP-Referer": settings.stock_api_url,
-                    "X-Title": "Stock Analysis AI",
-                }
+                extra_body=WEB_SEARCH_BODY,
+                extra_headers=self._extra_headers
             )
             
             result = response.choices[0].message.content
@@ -166,45 +326,43 @@ Be concise and focus on actionable insights."""
             logger.error(f"Market report error (OpenRouter): {e}")
             return f"Market news unavailable: {str(e)}"
 
-    def _build_context(self, technical_data, vision_analysis, news_context, history):
-        """Build context string for LLM"""
-        parts = ["You are a professional stock analysis AI assistant. Answer in Bahasa Indonesia."]
-        
-        if news_context:
-            parts.append(f"\n🌍 REAL-TIME MARKET NEWS:\n{news_context}\n")
+    def _build_messages(self, question, technical_data, vision_analysis, news_context, history) -> list:
+        """Static system prompt first, then per-request context, so the prefix bytes
+        repeat across calls and can hit OpenRouter's prompt cache"""
+        suffix = self._variable_suffix(technical_data, vision_analysis, news_context, history)
+        if logger.isEnabledFor(logging.DEBUG):
+            encoder, static_tokens = _load_encoder()
+            if encoder is not None:
+                # Only the per-request part is encoded; the prefix count is precomputed
+                dynamic = len(encoder.encode(suffix)) + len(encoder.encode(question))
+                logger.debug("Prompt tokens: %d (static %d + dynamic %d)", static_tokens + dynamic, static_tokens, dynamic)
+        return [
+            {"role": "system", "content": STATIC_PREFIX},
+            {"role": "system", "content": suffix},
+            {"role": "user", "content": question}
+        ]
+
+    def _variable_suffix(self, technical_data, vision_analysis, news_context, history) -> str:
+        """Build per-request context, ordered from most to least stable within a session"""
+        parts = []
 
         if technical_data:
-            parts.append(f"\nTechnical Indicators:\n{self._format_technical(technical_data)}")
-        
+            parts.append(f"Technical Indicators:\n{format_technical(technical_data)}")
+
+        if news_context:
+            parts.append(f"🌍 REAL-TIME MARKET NEWS:\n{news_context}")
+
         if vision_analysis:
-            parts.append(f"\nForecast Chart Analysis (from Vision AI):\n{vision_analysis}")
-        
+            parts.append(f"Forecast Chart Analysis (from Vision AI):\n{vision_analysis}")
+
         if history:
-            parts.append(f"\nRecent Conversation:\n{self._format_history(history)}")
-        
-        return "\n".join(parts)
-    
-    def _format_technical(self, data: dict) -> str:
-        """Format technical data for context"""
-        lines = []
-        if rsi := data.get('rsi'):
-            lines.append(f"- RSI: {rsi.get('current')} (Signal: {rsi.get('signal', 'N/A')})")
-        if macd := data.get('macd'):
-            lines.append(f"- MACD Signal: {macd.get('signal', 'N/A')}")
-        if dd := data.get('drawdown'):
-            lines.append(f"- Maximum Drawdown: {dd.get('max_drawdown')}%")
-        if cr := data.get('cumulative_returns'):
-            lines.append(f"- Total Return: {cr.get('total_return')}%")
-        if ma := data.get('moving_averages'):
-            lines.append(f"- MA20: {ma.get('ma20')}, MA50: {ma.get('ma50')}")
-        return "\n".join(lines) if lines else "No technical data available"
-    
-    def _format_history(self, history: list) -> str:
-        """Format conversation history"""
-        formatted = []
-        for h in history[-3:]: 
-            formatted.append(f"User: {h['user']}\nAssistant: {h['assistant']}")
-        return "\n\n".join(formatted)
+            parts.append(f"Recent Conversation:\n{self._format_history(history)}")
+
+        return "\n\n".join(parts) if parts else "No additional context."
+
+    def _format_history(self, history) -> str:
+        """Format conversation history (last 3 pre-formatted exchanges)"""
+        return "\n\n".join(islice(history, max(0, len(history) - 3), None))
 
 # Create singleton
 llm_client = LLMClient()
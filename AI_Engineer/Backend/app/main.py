@@ -1,23 +1,30 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import logging
-from app.chat_service import process_chat
+from app.chat_service import process_chat, process_chat_stream
 from app.memory import memory
+from app.llm_client import llm_client
+from app.config import settings
+import sys
 # Removed legacy gemini_client import
 
-# Setup logging
+# Setup logging (stderr, level from LOG_LEVEL; force replaces handlers set by imported libs)
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=settings.log_level.upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr,
+    force=True
 )
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Stock Analysis Chat AI",
     description="Hybrid chat system with JSON context and Vision analysis",
-    version="2.0"
+    version="2.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS for Frontend
@@ -50,37 +57,54 @@ async def root():
 
 @app.get("/health")
 async def health():
-    stats = memory.get_stats()
+    stats = await memory.get_stats()
     return {
         "status": "healthy",
         "memory_stats": stats
     }
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Main chat endpoint with hybrid processing"""
-    logger.info(f"Chat request for {request.ticker}: {request.message[:50]}...")
+async def chat(request: ChatRequest, x_no_cache: Optional[str] = Header(None)):
+    """Main chat endpoint with hybrid processing (send `x-no-cache` to bypass the semantic cache)"""
+    logger.info("Chat request for %s: %.50s...", request.ticker, request.message)
     
     result = await process_chat(
         ticker=request.ticker,
         message=request.message,
         technical_data=request.technical_data,
-        forecast_screenshot=request.forecast_screenshot
+        forecast_screenshot=request.forecast_screenshot,
+        use_cache=x_no_cache is None
     )
     
     return ChatResponse(**result)
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, x_no_cache: Optional[str] = Header(None)):
+    """Streaming chat endpoint (Server-Sent Events), tokens arrive as they are generated"""
+    logger.info("Chat stream request for %s: %.50s...", request.ticker, request.message)
+    
+    return StreamingResponse(
+        process_chat_stream(
+            ticker=request.ticker,
+            message=request.message,
+            technical_data=request.technical_data,
+            forecast_screenshot=request.forecast_screenshot,
+            use_cache=x_no_cache is None
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/memory/{ticker}")
 async def clear_memory(ticker: str):
     """Clear conversation memory for a ticker"""
-    memory.clear(ticker)
+    await memory.clear(ticker)
     return {"message": f"Memory cleared for {ticker}"}
 
 @app.get("/news/{ticker}")
 async def get_market_news(ticker: str):
     """Trigger Agent Search to get latest market news"""
     # SWITCH: Use OpenRouter (DeepSeek + Web Plugin)
-    from app.llm_client import llm_client
     news_report = await llm_client.generate_market_report(ticker)
     return {"ticker": ticker, "news": news_report}
 
@@ -89,10 +113,16 @@ async def get_market_news(ticker: str):
 async def startup_event():
     logger.info("Stock Analysis Chat AI starting up...")
     logger.info("Hybrid mode: JSON for technical, Vision for forecast")
+    await memory.connect()
+    llm_client.batcher.start()
+    await llm_client.warmup()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Stock Analysis Chat AI shutting down...")
+    await llm_client.batcher.stop()
+    await llm_client.close()
+    await memory.close()
 
 if __name__ == "__main__":
     import uvicorn
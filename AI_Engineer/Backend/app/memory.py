@@ -1,48 +1,171 @@
-from typing import Dict, List
+from collections import deque
+from typing import Deque, Dict, List, Optional
 import logging
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.embeddings import embedder
 
 logger = logging.getLogger(__name__)
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Keep last 10 exchanges to prevent memory bloat
+MAX_EXCHANGES = 10
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+
 class ConversationMemory:
-    """In-memory conversation storage per ticker"""
-    
+    """Conversation storage per ticker with semantic retrieval.
+    Backed by Redis when REDIS_URL is set (shared across workers), else in-process."""
+
     def __init__(self):
-        self.store: Dict[str, List[dict]] = {}
+        # Each exchange is stored pre-formatted ("User: ...\nAssistant: ...")
+        self.store: Dict[str, Deque[str]] = {}
+        # Normalized exchange embeddings, positions aligned with self.store[ticker]
+        self.vectors: Dict[str, Deque[np.ndarray]] = {}
+        self.semantic = faiss is not None and embedder.available
+        self.redis = None
+
+        if not self.semantic:
+            logger.warning("faiss/sentence-transformers missing. History falls back to most recent exchanges.")
         logger.info("Conversation memory initialized")
-    
-    def add_exchange(self, ticker: str, user_msg: str, ai_msg: str):
+
+    async def connect(self):
+        """Connect to Redis (called on app startup). Falls back to in-process storage."""
+        if not settings.redis_url:
+            logger.info("REDIS_URL not set. Using in-process conversation memory.")
+            return
+        if aioredis is None:
+            logger.warning("redis not installed. Using in-process conversation memory.")
+            return
+        try:
+            pool = aioredis.ConnectionPool.from_url(settings.redis_url, max_connections=64)
+            client = aioredis.Redis(connection_pool=pool)
+            await client.ping()
+            self.redis = client
+            logger.info("✅ Conversation memory connected to Redis")
+        except Exception as e:
+            logger.warning(f"⚠️ Redis connection failed ({e}). Using in-process conversation memory.")
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    @staticmethod
+    def _key(ticker: str, kind: str) -> str:
+        return f"chat:{ticker}:{kind}"
+
+    async def add_exchange(self, ticker: str, user_msg: str, ai_msg: str):
         """Add a user-AI exchange to memory"""
-        if ticker not in self.store:
-            self.store[ticker] = []
-        
-        self.store[ticker].append({
-            "user": user_msg,
-            "assistant": ai_msg
-        })
-        
-        # Keep last 10 exchanges to prevent memory bloat
-        if len(self.store[ticker]) > 10:
-            self.store[ticker] = self.store[ticker][-10:]
-        
-        logger.info(f"Added exchange for {ticker}. Total: {len(self.store[ticker])}")
-    
-    def get_history(self, ticker: str) -> List[dict]:
-        """Retrieve conversation history for a ticker"""
-        return self.store.get(ticker, [])
-    
-    def clear(self, ticker: str = None):
+        entry = f"User: {user_msg}\nAssistant: {ai_msg}"
+
+        vector = None
+        if self.semantic:
+            vector = await run_in_threadpool(self._embed, entry)
+            if vector is None:
+                # Embedding failed: zero vector keeps positions aligned and never ranks first
+                vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+
+        if self.redis is not None:
+            history_key = self._key(ticker, "history")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(history_key, entry.encode())
+                pipe.ltrim(history_key, -MAX_EXCHANGES, -1)
+                if vector is not None:
+                    vectors_key = self._key(ticker, "vectors")
+                    pipe.rpush(vectors_key, vector.tobytes())
+                    pipe.ltrim(vectors_key, -MAX_EXCHANGES, -1)
+                results = await pipe.execute()
+            total = min(results[0], MAX_EXCHANGES)
+        else:
+            history = self.store.setdefault(ticker, deque(maxlen=MAX_EXCHANGES))
+            history.append(entry)
+            if vector is not None:
+                self.vectors.setdefault(ticker, deque(maxlen=MAX_EXCHANGES)).append(vector)
+            total = len(history)
+
+        logger.info("Added exchange for %s. Total: %d", ticker, total)
+
+    async def get_history(self, ticker: str, query: str = None, k: int = 3) -> List[str]:
+        """Retrieve conversation history for a ticker (oldest first).
+        With a query, return the k exchanges most similar to it."""
+        want_semantic = bool(query) and self.semantic
+
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(self._key(ticker, "history"), 0, -1)
+                if want_semantic:
+                    pipe.lrange(self._key(ticker, "vectors"), 0, -1)
+                results = await pipe.execute()
+            history = [h.decode() for h in results[0]]
+            vectors = [np.frombuffer(v, dtype=np.float32) for v in results[1]] if want_semantic else []
+        else:
+            history = list(self.store.get(ticker, ()))
+            vectors = list(self.vectors.get(ticker, ())) if want_semantic else []
+
+        if not want_semantic or len(history) <= k or len(vectors) != len(history):
+            return history
+
+        q = await run_in_threadpool(self._embed, query)
+        if q is None:
+            return history
+
+        # At most MAX_EXCHANGES vectors, so a flat index is rebuilt per lookup
+        index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        index.add(np.stack(vectors))
+        _, ids = index.search(q[None, :], k)
+        return [history[i] for i in sorted(ids[0]) if 0 <= i < len(history)]
+
+    @staticmethod
+    def _embed(text: str) -> Optional[np.ndarray]:
+        vector = embedder.embed(text)
+        return np.asarray(vector, dtype=np.float32) if vector is not None else None
+
+    async def clear(self, ticker: str = None):
         """Clear memory for a specific ticker or all"""
-        if ticker:
-            if ticker in self.store:
-                del self.store[ticker]
-                logger.info(f"Cleared memory for {ticker}")
+        if self.redis is not None:
+            if ticker:
+                await self.redis.delete(*(self._key(ticker, kind) for kind in ("history", "vectors")))
+            else:
+                keys = [key async for key in self.redis.scan_iter(match="chat:*")]
+                if keys:
+                    await self.redis.delete(*keys)
+        elif ticker:
+            self.store.pop(ticker, None)
+            self.vectors.pop(ticker, None)
         else:
             self.store.clear()
-            logger.info("Cleared all memory")
-    
-    def get_stats(self) -> dict:
+            self.vectors.clear()
+
+        logger.info(f"Cleared memory for {ticker}" if ticker else "Cleared all memory")
+
+    async def get_stats(self) -> dict:
         """Get memory statistics"""
+        if self.redis is not None:
+            keys = [key async for key in self.redis.scan_iter(match="chat:*:history")]
+            lengths = []
+            if keys:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.llen(key)
+                    lengths = await pipe.execute()
+            return {
+                "backend": "redis",
+                "total_tickers": len(keys),
+                "total_exchanges": sum(lengths)
+            }
+
         return {
+            "backend": "in-process",
             "total_tickers": len(self.store),
             "total_exchanges": sum(len(h) for h in self.store.values())
         }
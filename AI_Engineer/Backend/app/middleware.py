@@ -3,23 +3,19 @@ import logging
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
-import tiktoken
 
 logger = logging.getLogger("observability")
 logger.setLevel(logging.INFO)
 
-# Tokenizer for rough estimation (using cl100k_base for Gemini/GPT-4 approx)
-enc = tiktoken.get_encoding("cl100k_base")
-
 class ObservabilityMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # Process request
         response = await call_next(request)
         
         # Calculate duration
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
         
         # Log Metrics
         # Note: We can't easily read body here without consuming stream, 
@@ -27,8 +23,8 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
         # But we can log latency and status code globally.
         
         logger.info(
-            f"METHOD={request.method} PATH={request.url.path} "
-            f"STATUS={response.status_code} LATENCY={process_time:.4f}s"
+            "METHOD=%s PATH=%s STATUS=%d LATENCY=%.4fs",
+            request.method, request.url.path, response.status_code, process_time
         )
         
         # Add latency header for frontend debugging
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from itertools import islice
+from typing import List, Optional, Tuple
+from app.config import settings
+from app.embeddings import embedder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+KV_SIZE_LIMIT = 2 ** 30  # 1GB on disk, LRU evicted
+KV_PREFIX = "respcache:"
+
+
+class RedisKV:
+    """Exact-match tier on Redis (same get/set interface as diskcache), shared by all workers"""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.client.ping()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(KV_PREFIX + key)
+
+    def set(self, key: str, value: str, expire: int):
+        self.client.set(KV_PREFIX + key, value, ex=expire)
+
+
+class SemanticCache:
+    """Two-tier response cache: exact-match on disk, then near-duplicate questions via ChromaDB"""
+
+    def __init__(self, persist_dir: str, threshold: float = 0.15, ttl: int = 86400,
+                 redis_url: Optional[str] = None, chroma_host: Optional[str] = None, chroma_port: int = 8000):
+        """
+        threshold: max cosine distance for a hit (0 = identical question)
+        ttl: seconds before a cached answer is considered stale
+        redis_url / chroma_host: shared backends for multi-worker deployments; without them
+        both tiers live under persist_dir, which only one process may write
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.kv = None
+        self.collection = None
+
+        # Tier 1: exact (question, context) -> answer, persisted across restarts
+        if redis_url and redis is not None:
+            try:
+                self.kv = RedisKV(redis_url)
+            except Exception as e:
+                logger.warning(f"Response cache Redis init failed: {e}")
+        elif diskcache is not None:
+            try:
+                self.kv = diskcache.Cache(
+                    os.path.join(persist_dir, "kv"),
+                    size_limit=KV_SIZE_LIMIT,
+                    eviction_policy="least-recently-used"
+                )
+            except Exception as e:
+                logger.warning(f"Response disk cache init failed: {e}")
+        else:
+            logger.warning("diskcache not installed. Exact-match response cache disabled.")
+
+        # Tier 2: semantic lookup on question embedding
+        if chromadb is None or not embedder.available:
+            logger.warning("chromadb/sentence-transformers missing. Semantic cache disabled.")
+        else:
+            try:
+                if chroma_host:
+                    client = chromadb.HttpClient(host=chroma_host, port=chroma_port)
+                else:
+                    client = chromadb.PersistentClient(path=persist_dir)
+                self.collection = client.get_or_create_collection(
+                    name="chat_responses",
+                    metadata={"hnsw:space": "cosine"}
+                )
+                self.prune()
+                location = f"{chroma_host}:{chroma_port}" if chroma_host else persist_dir
+                logger.info(f"Semantic cache ready at {location} ({self.collection.count()} entries)")
+            except Exception as e:
+                logger.warning(f"Semantic cache init failed: {e}. Caching will be disabled.")
+                self.collection = None
+
+        self.enabled = self.kv is not None or self.collection is not None
+
+    @staticmethod
+    def context_key(ticker: str, technical_data: dict, vision_analysis: str, news_context: str, history: list) -> str:
+        """Hash the ticker and non-question context so answers are only reused for the same symbol and data
+        (an empty context on a cold start is otherwise identical across tickers)"""
+        payload = json.dumps(
+            [ticker.upper(), technical_data, vision_analysis, news_context,
+             list(islice(history, max(0, len(history) - 3), None)) if history else []],
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _exact_key(question: str, context_key: str) -> str:
+        return hashlib.sha256((question + context_key).encode()).hexdigest()
+
+    def lookup(self, question: str, context_key: str, ticker: str) -> Tuple[Optional[str], Optional[List[float]]]:
+        """Return (cached_answer, question_embedding). Blocking, run in threadpool."""
+        if self.kv is not None:
+            try:
+                cached = self.kv.get(self._exact_key(question, context_key))
+                if cached is not None:
+                    logger.info("⚡ Response cache hit (exact)")
+                    return cached, None
+            except Exception as e:
+                logger.error(f"Response cache get error: {e}")
+
+        if self.collection is None:
+            return None, None
+
+        embedding = embedder.embed(question)
+        if embedding is None:
+            return None, None
+
+        try:
+            result = self.collection.query(
+                query_embeddings=[embedding],
+                n_results=1,
+                where={"$and": [
+                    {"ticker": ticker.upper()},
+                    {"context": context_key},
+                    {"expires_at": {"$gt": time.time()}}
+                ]}
+            )
+            if result["ids"] and result["ids"][0]:
+                distance = result["distances"][0][0]
+                if distance < self.threshold:
+                    logger.info("⚡ Semantic cache hit (distance=%.3f)", distance)
+                    return result["documents"][0][0], embedding
+        except Exception as e:
+            logger.error(f"Semantic cache lookup error: {e}")
+
+        return None, embedding
+
+    def store(self, question: str, context_key: str, ticker: str, response: str, embedding: Optional[List[float]] = None):
+        """Store an answer in both tiers. Blocking, run in threadpool."""
+        if self.kv is not None:
+            try:
+                self.kv.set(self._exact_key(question, context_key), response, expire=self.ttl)
+            except Exception as e:
+                logger.error(f"Response cache set error: {e}")
+
+        if self.collection is None or embedding is None:
+            return
+
+        try:
+            self.collection.add(
+                ids=[uuid.uuid4().hex],
+                embeddings=[embedding],
+                documents=[response],
+                metadatas=[{"ticker": ticker.upper(), "context": context_key, "expires_at": time.time() + self.ttl}]
+            )
+        except Exception as e:
+            logger.error(f"Semantic cache store error: {e}")
+
+    def get_vision(self, image_key: str) -> Optional[str]:
+        """Cached vision analysis for an image hash (disk tier only)"""
+        if self.kv is None:
+            return None
+        try:
+            return self.kv.get(f"vision:{image_key}")
+        except Exception as e:
+            logger.error(f"Vision cache get error: {e}")
+            return None
+
+    def store_vision(self, image_key: str, analysis: str):
+        if self.kv is None:
+            return
+        try:
+            self.kv.set(f"vision:{image_key}", analysis, expire=self.ttl)
+        except Exception as e:
+            logger.error(f"Vision cache set error: {e}")
+
+    def prune(self):
+        """Delete stale entries past their TTL"""
+        try:
+            self.collection.delete(where={"expires_at": {"$lt": time.time()}})
+        except Exception as e:
+            logger.error(f"Semantic cache prune error: {e}")
+
+# Create singleton
+semantic_cache = SemanticCache(
+    settings.chroma_persist_dir,
+    threshold=settings.semantic_cache_threshold,
+    ttl=settings.semantic_cache_ttl,
+    redis_url=settings.redis_url,
+    chroma_host=settings.chroma_host,
+    chroma_port=settings.chroma_port
+)
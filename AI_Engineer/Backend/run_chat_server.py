@@ -17,13 +17,38 @@ print("Port: 8005")
 print("=" * 50)
 
 try:
+    import importlib.util
     import uvicorn
-    from app.main import app
     
     # Cloud Run injects PORT env var
     port = int(os.environ.get("PORT", 8005))
     
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # Each worker has its own event loop, OpenRouter pool and in-process ConversationMemory,
+    # so history is only shared across workers once memory lives outside the process.
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    
+    # The local Chroma/diskcache stores are single-process: more workers need a Chroma
+    # server (CHROMA_HOST) and Redis (REDIS_URL) for the shared caches
+    if workers > 1 and not (os.environ.get("CHROMA_HOST") and os.environ.get("REDIS_URL")):
+        print(f"WARNING: WEB_CONCURRENCY={workers} needs CHROMA_HOST and REDIS_URL; running 1 worker")
+        workers = 1
+    
+    # uvloop/httptools are not available on Windows; fall back to the stdlib loop there
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    
+    print(f"Workers: {workers} (loop={loop}, http={http})")
+    
+    # Import string (not the app object) is required for workers > 1
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=port,
+        log_level="info",
+        loop=loop,
+        http=http,
+        workers=workers
+    )
     
 except Exception as e:
     print(f"ERROR: {e}")
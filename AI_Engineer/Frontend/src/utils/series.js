@@ -0,0 +1,14 @@
+// DataAgent API sends long series as Plotly typed arrays: { dtype: 'f4', bdata: <base64 float32> }
+export const decodeSeries = (value) => {
+  if (!value || typeof value.bdata !== 'string') return value
+  const bytes = Uint8Array.from(atob(value.bdata), c => c.charCodeAt(0))
+  return new Float32Array(bytes.buffer)
+}
+
+// Latest finite value of a (possibly encoded) series, rounded for display/LLM context
+export const lastValue = (value, digits = 2) => {
+  const series = decodeSeries(value)
+  if (!series || !series.length) return null
+  const last = series[series.length - 1]
+  return Number.isFinite(last) ? Number(last.toFixed(digits)) : null
+}
@@ -6,19 +6,32 @@ Returns JSON data for interactive Plotly charts
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, List, Any
 import yfinance as yf
 import pandas as pd
 import numpy as np
+import orjson
+import bottleneck as bn
+from numba import njit
 import logging
-import requests
-from datetime import timedelta, datetime
+import asyncio
+import base64
+import httpx
+from starlette.concurrency import run_in_threadpool
+from cache import MarketDataCache
 
 import os
 
 MLE_API_URL = os.getenv("MLE_API_URL", "http://localhost:8002/predict")
 
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# Pooled client shared by all MLE calls (opened on startup)
+http_client: Optional[httpx.AsyncClient] = None
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,7 +39,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="DataAgent API",
     description="Technical Analysis & Chart Data Service",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -38,6 +52,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Daily OHLCV cache (disabled when Redis is unreachable)
+market_cache = MarketDataCache(host=REDIS_HOST, port=REDIS_PORT)
+
 # =====================================================
 # SCHEMAS
 # =====================================================
@@ -89,6 +106,24 @@ class AnalyzeResponse(BaseModel):
     statistics: Optional[Dict[str, Any]] = None
     chart_data: Optional[Dict[str, Any]] = None
 
+class NumpyORJSONResponse(ORJSONResponse):
+    """orjson response that writes numpy arrays directly (no .tolist() copies)"""
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC)
+
+def analyze_response(ticker: str, success: bool, technical_summary: Optional[str] = None,
+                     error: Optional[str] = None, statistics: Optional[Dict[str, Any]] = None,
+                     chart_data: Optional[Dict[str, Any]] = None) -> NumpyORJSONResponse:
+    """AnalyzeResponse body, serialized as-is (skips the pydantic validate/copy pass)"""
+    return NumpyORJSONResponse(content={
+        "ticker": ticker,
+        "success": success,
+        "technical_summary": technical_summary,
+        "error": error,
+        "statistics": statistics,
+        "chart_data": chart_data
+    })
+
 # =====================================================
 # CORE ANALYSIS FUNCTIONS
 # =====================================================
@@ -99,16 +134,40 @@ def fetch_data(ticker: str, period: str) -> pd.DataFrame:
     data = stock.history(period=period)
     return data
 
-def calculate_rsi(data: pd.DataFrame, period: int = 14) -> Dict:
-    """Calculate RSI indicator"""
-    delta = data['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+async def get_market_data(ticker: str, period: str) -> pd.DataFrame:
+    """OHLCV from the Redis cache, else yfinance (one fetch per key at a time)"""
+    key = market_cache.key(ticker, period)
+    data = await run_in_threadpool(market_cache.get, key)
+    if data is not None:
+        return data
     
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
+    async with market_cache.lock(key):
+        # Another request may have filled the cache while we waited
+        data = await run_in_threadpool(market_cache.get, key)
+        if data is None:
+            data = await run_in_threadpool(fetch_data, ticker, period)
+            if data is not None and not data.empty:
+                await run_in_threadpool(market_cache.set, key, data)
+    return data
+
+def _b64(values, fill: Optional[float] = None) -> Dict[str, str]:
+    """Series as a Plotly typed array: base64 of float32 bytes (NaN stays a gap unless filled)"""
+    arr = np.asarray(values, dtype=np.float32)
+    if fill is not None:
+        arr = np.where(np.isnan(arr), np.float32(fill), arr)
+    return {"dtype": "f4", "bdata": base64.b64encode(np.ascontiguousarray(arr).tobytes()).decode()}
+
+def calculate_rsi(delta: np.ndarray, dates: List[str], period: int = 14) -> Dict:
+    """Calculate RSI indicator from price changes"""
+    gain = bn.move_mean(np.maximum(delta, 0.0), period, min_count=period)
+    loss = bn.move_mean(np.maximum(-delta, 0.0), period, min_count=period)
     
-    current_rsi = float(rsi.iloc[-1]) if not rsi.empty else 50
+    # No losses in the window: rs=inf gives RSI 100, flat window gives NaN (filled as 50)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
+        rsi = 100 - (100 / (1 + rs))
+    
+    current_rsi = float(rsi[-1]) if rsi.size else 50
     
     if current_rsi > 70:
         signal = "overbought"
@@ -118,23 +177,43 @@ def calculate_rsi(data: pd.DataFrame, period: int = 14) -> Dict:
         signal = "neutral"
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "values": [float(v) if not pd.isna(v) else 50 for v in rsi.tolist()],
+        "dates": dates,
+        "values": _b64(rsi, 50),
         "current": current_rsi,
         "signal": signal
     }
 
-def calculate_macd(data: pd.DataFrame) -> Dict:
+# No fastmath: reassociating the recursive EMA updates would drift from pandas ewm(adjust=False)
+@njit(cache=True)
+def _macd_kernel(close):
+    """EMA(12), EMA(26), signal EMA(9) and histogram in one pass (same as ewm(adjust=False))"""
+    n = close.size
+    a12, a26, a9 = 2.0 / 13.0, 2.0 / 27.0, 2.0 / 10.0
+    e12 = e26 = sig = 0.0
+    macd = np.empty(n)
+    signal = np.empty(n)
+    hist = np.empty(n)
+    for i in range(n):
+        x = close[i]
+        if i == 0:
+            e12 = x
+            e26 = x
+        else:
+            e12 += a12 * (x - e12)
+            e26 += a26 * (x - e26)
+        m = e12 - e26
+        sig = m if i == 0 else sig + a9 * (m - sig)
+        macd[i] = m
+        signal[i] = sig
+        hist[i] = m - sig
+    return macd, signal, hist
+
+def calculate_macd(close: np.ndarray, dates: List[str]) -> Dict:
     """Calculate MACD indicator"""
-    exp1 = data['Close'].ewm(span=12, adjust=False).mean()
-    exp2 = data['Close'].ewm(span=26, adjust=False).mean()
+    macd_line, signal_line, histogram = _macd_kernel(close)
     
-    macd_line = exp1 - exp2
-    signal_line = macd_line.ewm(span=9, adjust=False).mean()
-    histogram = macd_line - signal_line
-    
-    current_hist = float(histogram.iloc[-1])
-    prev_hist = float(histogram.iloc[-2])
+    current_hist = float(histogram[-1])
+    prev_hist = float(histogram[-2])
     
     if current_hist > 0 and prev_hist <= 0:
         signal = "bullish_crossover"
@@ -144,95 +223,116 @@ def calculate_macd(data: pd.DataFrame) -> Dict:
         signal = "neutral"
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "macd_line": [float(v) if not pd.isna(v) else 0 for v in macd_line.tolist()],
-        "signal_line": [float(v) if not pd.isna(v) else 0 for v in signal_line.tolist()],
-        "histogram": [float(v) if not pd.isna(v) else 0 for v in histogram.tolist()],
+        "dates": dates,
+        "macd_line": _b64(macd_line, 0),
+        "signal_line": _b64(signal_line, 0),
+        "histogram": _b64(histogram, 0),
         "signal": signal
     }
 
-def calculate_bollinger(data: pd.DataFrame, window: int = 20, num_std: int = 2) -> Dict:
-    """Calculate Bollinger Bands"""
-    ma = data['Close'].rolling(window=window).mean()
-    std = data['Close'].rolling(window=window).std()
+def calculate_bollinger(close: np.ndarray, ma: np.ndarray, close_b64: Dict[str, str], dates: List[str],
+                        window: int = 20, num_std: int = 2) -> Dict:
+    """Calculate Bollinger Bands around a precomputed moving average"""
+    std = bn.move_std(close, window, min_count=window, ddof=1)
     
     upper = ma + (num_std * std)
     lower = ma - (num_std * std)
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "upper": [float(v) if not pd.isna(v) else 0 for v in upper.tolist()],
-        "middle": [float(v) if not pd.isna(v) else 0 for v in ma.tolist()],
-        "lower": [float(v) if not pd.isna(v) else 0 for v in lower.tolist()],
-        "close": data['Close'].tolist()
+        "dates": dates,
+        "upper": _b64(upper, 0),
+        "middle": _b64(ma, 0),
+        "lower": _b64(lower, 0),
+        "close": close_b64
     }
 
-def calculate_moving_averages(data: pd.DataFrame) -> Dict:
+def calculate_moving_averages(close: np.ndarray, ma20: np.ndarray, close_b64: Dict[str, str], dates: List[str]) -> Dict:
     """Calculate MA20, MA50"""
-    ma20 = data['Close'].rolling(window=20).mean()
-    ma50 = data['Close'].rolling(window=50).mean()
+    ma50 = bn.move_mean(close, 50, min_count=50)
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "close": data['Close'].tolist(),
-        "ma20": [float(v) if not pd.isna(v) else None for v in ma20.tolist()],
-        "ma50": [float(v) if not pd.isna(v) else None for v in ma50.tolist()]
+        "dates": dates,
+        "close": close_b64,
+        "ma20": _b64(ma20),
+        "ma50": _b64(ma50)
     }
 
-def calculate_drawdown(data: pd.DataFrame) -> Dict:
+def calculate_drawdown(close: np.ndarray, dates: List[str]) -> Dict:
     """Calculate drawdown - % drop from peak"""
-    close = data['Close']
-    running_max = close.cummax()
+    running_max = np.maximum.accumulate(close)
     drawdown = ((close - running_max) / running_max) * 100
     
     max_drawdown = drawdown.min()
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "drawdown": drawdown.tolist(),
+        "dates": dates,
+        "drawdown": _b64(drawdown),
         "max_drawdown": round(float(max_drawdown), 2)
     }
 
-def calculate_cumulative_returns(data: pd.DataFrame) -> Dict:
-    """Calculate cumulative returns"""
-    returns = data['Close'].pct_change()
-    cumulative = (1 + returns).cumprod() - 1
+def calculate_cumulative_returns(returns: np.ndarray, dates: List[str]) -> Dict:
+    """Calculate cumulative returns from daily returns"""
+    cumulative = np.cumprod(1 + returns) - 1
     cumulative = cumulative * 100  # Convert to percentage
     
-    total_return = cumulative.iloc[-1]
+    total_return = cumulative[-1]
     
     return {
-        "dates": data.index.strftime('%Y-%m-%d').tolist(),
-        "cumulative": cumulative.tolist(),
+        "dates": dates,
+        "cumulative": _b64(cumulative),
         "total_return": round(float(total_return), 2)
     }
 
-def calculate_statistics(data: pd.DataFrame) -> Dict:
-    """Calculate summary statistics"""
-    close = data['Close']
-    returns = close.pct_change().dropna()
+def compute_all_indicators(close: np.ndarray, dates: List[str]) -> Dict[str, Dict]:
+    """All chart indicators from one close array.
+    Price changes, daily returns, MA20 and the encoded close are computed once and shared."""
+    close_b64 = _b64(close)
+    delta = np.diff(close, prepend=close[0])  # First change is 0 (no prior close)
+    # Daily returns; day 0 has no prior close and counts as 0%
+    returns = np.empty_like(close)
+    returns[0] = 0.0
+    returns[1:] = close[1:] / close[:-1] - 1
+    ma20 = bn.move_mean(close, 20, min_count=20)
     
     return {
-        "current_price": float(close.iloc[-1]),
-        "start_price": float(close.iloc[0]),
-        "change_pct": float((close.iloc[-1] / close.iloc[0] - 1) * 100),
+        "rsi": calculate_rsi(delta, dates),
+        "macd": calculate_macd(close, dates),
+        "bollinger": calculate_bollinger(close, ma20, close_b64, dates),
+        "moving_averages": calculate_moving_averages(close, ma20, close_b64, dates),
+        "drawdown": calculate_drawdown(close, dates),
+        "cumulative_returns": calculate_cumulative_returns(returns, dates),
+        "returns": {"values": _b64(returns[1:])}
+    }
+
+def calculate_statistics(close: np.ndarray, volume: np.ndarray) -> Dict:
+    """Calculate summary statistics from float64 arrays"""
+    returns = np.diff(close) / close[:-1]
+    # Sample std (ddof=1) as pandas did; undefined below two returns
+    ret_mean = float(returns.mean()) if returns.size else 0.0
+    ret_std = float(returns.std(ddof=1)) if returns.size > 1 else 0.0
+    
+    return {
+        "current_price": float(close[-1]),
+        "start_price": float(close[0]),
+        "change_pct": float((close[-1] / close[0] - 1) * 100),
         "min_price": float(close.min()),
         "max_price": float(close.max()),
-        "avg_volume": float(data['Volume'].mean()),
-        "volatility_annual": float(returns.std() * np.sqrt(252) * 100),
-        "sharpe_ratio": float(returns.mean() / returns.std() * np.sqrt(252)) if returns.std() > 0 else 0,
-        "data_points": len(close)
+        "avg_volume": float(volume.mean()),
+        "volatility_annual": ret_std * np.sqrt(252) * 100,
+        "sharpe_ratio": ret_mean / ret_std * np.sqrt(252) if ret_std > 0 else 0,
+        "data_points": int(close.size)
     }
 
-def get_forecast(ticker: str, data: List[float]) -> List[float]:
-    """Call MLE API to get forecast"""
+async def get_forecast(ticker: str, data: np.ndarray) -> List[float]:
+    """Call MLE API to get forecast (empty input returns no forecast)"""
+    if data.size == 0:
+        return []
     try:
-        # Ensure data is simple list of floats
-        payload = {
-            "ticker": ticker,
-            "data": [float(x) for x in data]
-        }
-        response = requests.post(MLE_API_URL, json=payload, timeout=5)
+        # orjson writes the float64 array straight into the JSON body
+        payload = orjson.dumps({"ticker": ticker, "data": data}, option=orjson.OPT_SERIALIZE_NUMPY)
+        response = await http_client.post(
+            MLE_API_URL, content=payload, headers={"Content-Type": "application/json"}
+        )
         if response.status_code == 200:
             return response.json().get("forecast", [])
         else:
@@ -243,16 +343,9 @@ def get_forecast(ticker: str, data: List[float]) -> List[float]:
         return []
 
 def generate_future_dates(start_date_str: str, days: int) -> List[str]:
-    """Generate future business dates"""
-    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    future_dates = []
-    current_date = start_date
-    while len(future_dates) < days:
-        current_date += timedelta(days=1)
-        # Skip weekends (5=Sat, 6=Sun)
-        if current_date.weekday() < 5:
-            future_dates.append(current_date.strftime('%Y-%m-%d'))
-    return future_dates
+    """Generate future business dates (weekends skipped)"""
+    start = pd.Timestamp(start_date_str) + pd.Timedelta(days=1)
+    return pd.bdate_range(start=start, periods=days).strftime('%Y-%m-%d').tolist()
 
 def build_summary(ticker: str, stats: Dict, rsi: Dict, macd: Dict) -> str:
     """Build text summary"""
@@ -269,6 +362,20 @@ def build_summary(ticker: str, stats: Dict, rsi: Dict, macd: Dict) -> str:
 # ENDPOINTS
 # =====================================================
 
+@app.on_event("startup")
+async def startup_event():
+    global http_client
+    # Keep-alive pool to the MLE API; one retry on connection failures
+    transport = httpx.AsyncHTTPTransport(
+        retries=1,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+    http_client = httpx.AsyncClient(transport=transport, timeout=5)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     return {"service": "DataAgent API", "version": "1.0.0", "port": 8003}
@@ -277,7 +384,7 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
-@app.post("/analyze", response_model=AnalyzeResponse)
+@app.post("/analyze", response_class=NumpyORJSONResponse, responses={200: {"model": AnalyzeResponse}})
 async def analyze(request: AnalyzeRequest):
     """
     Full technical analysis with chart data for Plotly rendering
@@ -287,38 +394,31 @@ async def analyze(request: AnalyzeRequest):
     
     try:
         # Fetch data
-        data = fetch_data(ticker, request.period)
+        data = await get_market_data(ticker, request.period)
         
         if data is None or len(data) < 60:
-            return AnalyzeResponse(
+            return analyze_response(
                 ticker=ticker,
                 success=False,
                 error="Insufficient data (need at least 60 data points)"
             )
         
+        # Formatted once and shared by every indicator
+        dates = data.index.strftime('%Y-%m-%d').tolist()
+        close_arr = data['Close'].to_numpy(dtype=np.float64)
+        
         # Calculate all indicators
-        rsi = calculate_rsi(data)
-        macd = calculate_macd(data)
-        bollinger = calculate_bollinger(data)
-        ma = calculate_moving_averages(data)
-        drawdown = calculate_drawdown(data)
-        cumulative_returns = calculate_cumulative_returns(data)
-        stats = calculate_statistics(data)
+        indicators = compute_all_indicators(close_arr, dates)
+        stats = calculate_statistics(close_arr, data['Volume'].to_numpy(dtype=np.float64))
         
         # Build candlestick data
         candlestick = {
-            "dates": data.index.strftime('%Y-%m-%d').tolist(),
-            "open": data['Open'].tolist(),
-            "high": data['High'].tolist(),
-            "low": data['Low'].tolist(),
-            "close": data['Close'].tolist(),
-            "volume": data['Volume'].tolist()
-        }
-        
-        # Returns distribution
-        returns = data['Close'].pct_change().dropna()
-        returns_data = {
-            "values": returns.tolist()
+            "dates": dates,
+            "open": _b64(data['Open']),
+            "high": _b64(data['High']),
+            "low": _b64(data['Low']),
+            "close": indicators["moving_averages"]["close"],
+            "volume": _b64(data['Volume'])
         }
         
         # ==========================================
@@ -329,82 +429,73 @@ async def analyze(request: AnalyzeRequest):
             "future": {"dates": [], "predicted": []}
         }
         
-        close_prices = data['Close'].tolist()
-        dates = data.index.strftime('%Y-%m-%d').tolist()
+        # Forecast inputs and plots are numpy views of the close array (serialized by orjson)
+        n_prices = close_arr.size
+        
+        # Validation and future windows are forecast concurrently
+        val_pred, future_pred = await asyncio.gather(
+            get_forecast(ticker, close_arr[-90:-30] if n_prices >= 90 else close_arr[:0]),
+            get_forecast(ticker, close_arr[-60:])
+        )
         
         # 1. Validation Forecast (Predict last 30 days using prior 60)
         # Need at least 90 days total: 60 input + 30 target
-        if len(close_prices) >= 90:
-            # Inputs: prices from -90 to -30
-            input_val = close_prices[-90:-30]
+        if n_prices >= 90:
+            # Inputs: prices from -90 to -30 (forecast above)
             # Targets: prices from -30 to end
-            target_val = close_prices[-30:]
+            target_val = close_arr[-30:]
             target_dates = dates[-30:]
             
-            # Call MLE
-            val_pred = get_forecast(ticker, input_val)
-            
             if val_pred:
                 # Calculate MAE (Mean Absolute Error)
-                mae = np.mean(np.abs(np.array(target_val) - np.array(val_pred)))
+                mae = np.mean(np.abs(target_val - np.asarray(val_pred)))
                 
                 forecast_data["validation"] = {
                     "dates": target_dates,
                     "actual": target_val,
                     "predicted": val_pred,
                     "full_dates": dates,
-                    "full_actual": close_prices,
+                    "full_actual": close_arr,
                     "mae": round(float(mae), 2)
                 }
         
         # 2. Future Forecast (Predict next 30 days using last 60)
-        if len(close_prices) >= 60:
-            input_future = close_prices[-60:]
+        if n_prices >= 60:
             last_date = dates[-1]
             
-            # Call MLE
-            future_pred = get_forecast(ticker, input_future)
-            
             if future_pred:
                 future_dates = generate_future_dates(last_date, len(future_pred))
                 
                 # Use MAE from validation for confidence intervals
                 mae_value = forecast_data.get("validation", {}).get("mae", 0)
+                future_arr = np.asarray(future_pred, dtype=np.float64)
                 
                 forecast_data["future"] = {
                     "dates": future_dates,
                     "predicted": future_pred,
-                    "predicted_upper": [p + mae_value for p in future_pred],  # Optimistic
-                    "predicted_lower": [p - mae_value for p in future_pred],  # Pessimistic
-                    "history": close_prices[-60:],
+                    "predicted_upper": future_arr + mae_value,  # Optimistic
+                    "predicted_lower": future_arr - mae_value,  # Pessimistic
+                    "history": close_arr[-60:],
                     "history_dates": dates[-60:],
                     "mae": mae_value
                 }
         
         # Build response
-        
-        # Build response
-        return AnalyzeResponse(
+        return analyze_response(
             ticker=ticker,
             success=True,
-            technical_summary=build_summary(ticker, stats, rsi, macd),
+            technical_summary=build_summary(ticker, stats, indicators["rsi"], indicators["macd"]),
             statistics=stats,
             chart_data={
                 "candlestick": candlestick,
-                "rsi": rsi,
-                "macd": macd,
-                "bollinger": bollinger,
-                "moving_averages": ma,
-                "drawdown": drawdown,
-                "cumulative_returns": cumulative_returns,
-                "returns": returns_data,
+                **indicators,
                 "forecast": forecast_data
             }
         )
         
     except Exception as e:
         logger.error(f"Analysis error: {e}", exc_info=True)
-        return AnalyzeResponse(
+        return analyze_response(
             ticker=ticker,
             success=False,
             error=str(e)
@@ -0,0 +1,85 @@
+import io
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+import pandas as pd
+import redis
+
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = "America/New_York"
+MARKET_CLOSE_HOUR = 16  # 16:00 ET
+
+def seconds_until_next_close(now: Optional[pd.Timestamp] = None) -> int:
+    """Seconds until the next weekday 16:00 ET close (OHLCV only changes then)"""
+    now = now or pd.Timestamp.now(tz=MARKET_TZ)
+    close = now.normalize() + pd.Timedelta(hours=MARKET_CLOSE_HOUR)
+    if now >= close:
+        close += pd.Timedelta(days=1)
+    while close.weekday() >= 5:
+        close += pd.Timedelta(days=1)
+    return max(60, int((close - now).total_seconds()))
+
+class MarketDataCache:
+    def __init__(self, host='localhost', port=6379, db=1):
+        """
+        Initialize Redis connection for yfinance OHLCV frames (stored as parquet).
+        Entries expire at the next market close.
+        """
+        self.enabled = False
+        # One in-flight yfinance fetch per key; concurrent misses wait on it.
+        # key -> [lock, holders + waiters]; dropped when the last one leaves
+        self._locks: Dict[str, List] = {}
+        try:
+            self.redis = redis.Redis(host=host, port=port, db=db)
+            self.redis.ping()
+            self.enabled = True
+            logger.info(f"✅ Redis connected successfully at {host}:{port}")
+        except redis.ConnectionError:
+            logger.warning("⚠️ Redis connection failed. Market data caching will be disabled.")
+            self.redis = None
+
+    def key(self, ticker: str, period: str) -> str:
+        today = datetime.now(timezone.utc).date()
+        return f"ohlcv:{ticker.upper()}:{period}:{today}"
+
+    @asynccontextmanager
+    async def lock(self, key: str) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            # Single event loop, so the count cannot change between these lines
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        if not self.enabled:
+            return None
+
+        try:
+            val = self.redis.get(key)
+            if val:
+                logger.info(f"⚡ Market data cache hit for {key}")
+                return pd.read_parquet(io.BytesIO(val))
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+
+        return None
+
+    def set(self, key: str, data: pd.DataFrame):
+        if not self.enabled:
+            return
+
+        try:
+            self.redis.setex(key, seconds_until_next_close(), data.to_parquet())
+            logger.debug(f"💾 Cached market data for {key}")
+        except Exception as e:
+            logger.error(f"Redis set error: {e}")
@@ -1,36 +1,62 @@
 
 import os
-import io
-import pickle
+import base64
+
+# --- PERFORMANCE TUNING ---
+# Critical for high-concurrency: Prevent PyTorch from using all cores per request.
+# OpenMP/MKL read these at library init, so they must be set before importing torch.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+os.environ.setdefault("TORCH_NUM_THREADS", "1")
+
 import torch
-import torch.nn as nn
 import numpy as np
+import threading
+from cachetools import LRUCache
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Dict
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Dict, Optional
 import logging
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- PERFORMANCE TUNING ---
-# Critical for high-concurrency: Prevent PyTorch from using all cores per request
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["TORCH_NUM_THREADS"] = "1"
+# Env vars above cover native init; these apply to torch's own pools
+torch.set_num_threads(1)
+torch.set_num_interop_threads(1)
 
 # --- MODEL LOADER UTILS ---
-class CPU_Unpickler(pickle.Unpickler):
-    def find_class(self, module, name):
-        if module == 'torch.storage' and name == '_load_from_bytes':
-            return lambda b: torch.load(io.BytesIO(b), map_location='cpu')
-        else:
-            return super().find_class(module, name)
+from model_io import (
+    serving_extensions, find_model_path, is_eager, load_for_serving, compile_model,
+    bf16_supported, input_dtype, example_batch, INPUT_SIZE
+)
+
+# MODEL_DTYPE=bf16 serves checkpoints in bfloat16 on CPUs with native BF16 support.
+# Otherwise Linear layers are quantized to INT8 (at load time for checkpoints, at export for TorchScript).
+MODEL_DTYPE = os.getenv("MODEL_DTYPE", "int8").lower()
+SERVE_BF16 = MODEL_DTYPE == "bf16" and bf16_supported()
+if MODEL_DTYPE == "bf16" and not SERVE_BF16:
+    logger.warning("MODEL_DTYPE=bf16 requested but this CPU has no native BF16, serving INT8")
+MODEL_VERSION = "N-BEATS-BF16" if SERVE_BF16 else "N-BEATS-INT8"
+# Exports are served as saved, whatever MODEL_DTYPE says: ONNX is FP32, TorchScript is INT8
+EXPORT_VERSIONS = {".onnx": "N-BEATS-ONNX-FP32", ".pt": "N-BEATS-TS-INT8"}
+
+# Opt-in torch.compile mode for eager (.ckpt/.pkl) models, e.g. "default" ("reduce-overhead" needs CUDA); empty = off.
+# TorchScript exports are already a frozen graph and are served as-is.
+TORCH_COMPILE_MODE = os.getenv("TORCH_COMPILE_MODE", "")
+
+MODEL_EXTENSIONS = serving_extensions(SERVE_BF16)
 
 def get_model_path(ticker: str):
-    return os.path.join("models", f"{ticker}_nbeats.pkl")
+    return find_model_path("models", ticker, MODEL_EXTENSIONS)
+
+def model_version(path: str) -> str:
+    """Reported model_version for the artifact actually served from `path`"""
+    return EXPORT_VERSIONS.get(os.path.splitext(path)[1], MODEL_VERSION)
 
 # --- SCHEMAS ---
 class PredictionRequest(BaseModel):
@@ -38,18 +64,32 @@ class PredictionRequest(BaseModel):
     # For future: could add horizon or data input here
     # For now, we'll assume we fetch the latest 60 days via yfinance or similar
     # But for a pure inference API, let's accept the input data (insample_y)
-    data: List[float] = Field(..., min_items=60, max_items=60, description="Last 60 days of Close prices")
+    data: Optional[List[float]] = Field(None, min_items=60, max_items=60, description="Last 60 days of Close prices")
+    data_b64: Optional[str] = Field(None, description="Alternative to data: base64 of the 60 closes as little-endian float32")
+
+    @model_validator(mode="after")
+    def decode_data_b64(self):
+        # Compact payload: one frombuffer instead of parsing 60 JSON floats
+        if self.data is None:
+            if self.data_b64 is None:
+                raise ValueError("Either data or data_b64 is required")
+            values = np.frombuffer(base64.b64decode(self.data_b64, validate=True), dtype="<f4")
+            if values.size != INPUT_SIZE:
+                raise ValueError(f"data_b64 must hold {INPUT_SIZE} float32 values, got {values.size}")
+            self.data = values.astype(np.float64).tolist()
+        return self
 
 class PredictionResponse(BaseModel):
     ticker: str
     forecast: List[float]
-    model_version: str = "N-BEATS-FP32"
+    model_version: str
 
 # --- APP SETUP ---
 app = FastAPI(
     title="Stock Forecasting API",
     description="Production-grade API for stock price forecasting using N-BEATS",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS - Allow all origins for microservices communication
@@ -61,36 +101,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global model cache (lazy loading)
-model_cache = {}
+# Global model cache (lazy loading), bounded: each N-BEATS model is tens of MB
+from prometheus_middleware import MODEL_EVICTION_COUNTER
+
+class ModelCache(LRUCache):
+    def popitem(self):
+        ticker, entry = super().popitem()
+        MODEL_EVICTION_COUNTER.inc()
+        logger.info(f"Evicted model for {ticker} from cache")
+        return ticker, entry
+
+model_cache = ModelCache(maxsize=int(os.getenv("MODEL_CACHE_SIZE", 32)))
+# LRUCache is not thread-safe (lookups reorder it)
+model_cache_lock = threading.RLock()
 
 def load_model_for_ticker(ticker: str):
-    if ticker in model_cache:
-        return model_cache[ticker]
+    """Cached (model, model_version) for a ticker, loaded (and compiled) on a miss.
+    Blocking: call via run_in_threadpool."""
+    with model_cache_lock:
+        entry = model_cache.get(ticker)
+    if entry is not None:
+        return entry
     
     path = get_model_path(ticker)
     if not os.path.exists(path):
         raise FileNotFoundError(f"Model for {ticker} not found at {path}")
     
-    logger.info(f"Loading model for {ticker}...")
-    with open(path, 'rb') as f:
-        model_data = CPU_Unpickler(f).load()
-    
-    # Extract model from NeuralForecast wrapper if needed
-    if isinstance(model_data, dict):
-        model = model_data.get('model') or model_data
-    else:
-        model = model_data
-        
-    if hasattr(model, 'models'):
-        core_model = model.models[0]
-    else:
-        core_model = model
-        
-    core_model.eval()
-    core_model.to('cpu')
-    model_cache[ticker] = core_model
-    return core_model
+    logger.info(f"Loading model for {ticker} from {path}...")
+    core_model = load_for_serving(path, SERVE_BF16)
+    if TORCH_COMPILE_MODE and is_eager(path):
+        core_model = compile_model(core_model, TORCH_COMPILE_MODE, warm_batch_sizes=(1, 2, MAX_BATCH))
+    entry = (core_model, model_version(path))
+    with model_cache_lock:
+        model_cache[ticker] = entry
+    return entry
 
 # --- PROMETHEUS SETUP ---
 from prometheus_middleware import PrometheusMiddleware, metrics_endpoint, PREDICTION_COUNTER
@@ -105,14 +149,44 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "loaded_models": list(model_cache.keys())}
+    with model_cache_lock:
+        loaded = list(model_cache.keys())
+    return {"status": "healthy", "loaded_models": loaded}
     
 # --- CACHE SETUP ---
 from cache import PredictionCache
 cache = PredictionCache()
 
-# --- ASYNC HELPERS ---
-from starlette.concurrency import run_in_threadpool
+# --- BATCHING SETUP ---
+# Concurrent cache misses for the same ticker are stacked into one forward pass
+from batcher import PredictionBatcher, MAX_BATCH
+batcher = PredictionBatcher()
+
+# Models loaded at startup so their first request skips disk + unpickle
+PRELOAD_TICKERS = [t for t in os.getenv("PRELOAD_TICKERS", "NVDA,MSFT,GOOGL,AMZN,TSLA").split(",") if t]
+
+def _preload(ticker: str):
+    model, _ = load_model_for_ticker(ticker)
+    # One dummy forward warms BLAS / TorchScript kernels
+    with torch.no_grad():
+        model(example_batch(1, input_dtype(model)))
+
+@app.on_event("startup")
+async def startup_event():
+    for ticker in PRELOAD_TICKERS:
+        ticker = ticker.strip().upper()
+        try:
+            # Off the event loop: disk, unpickle and torch.compile are all blocking
+            await run_in_threadpool(_preload, ticker)
+            logger.info(f"🔥 Preloaded model for {ticker}")
+        except FileNotFoundError:
+            logger.warning(f"No model to preload for {ticker}")
+        except Exception as e:
+            logger.error(f"Preload failed for {ticker}: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batcher.stop()
 
 @app.post("/predict", response_model=PredictionResponse)
 async def predict(request: PredictionRequest):
@@ -125,16 +199,13 @@ async def predict(request: PredictionRequest):
         return PredictionResponse(
             ticker=ticker,
             forecast=cached_forecast,
-            model_version="N-BEATS-FP32-CACHED"
+            # Stat calls only: the artifact currently served produced the cached forecast
+            model_version=f"{model_version(get_model_path(ticker))}-CACHED"
         )
         
     try:
-        # Load model (can be blocking IO, run in threadpool if it becomes slow, 
-        # but for now caching handles it. N-BEATS load is fast-ish once in memory?)
-        # Actually load_model_for_ticker is blocking too if it hits disk.
-        # But let's verify if we need to offload that.
-        # model_cache is global dict, so it's fast.
-        model = load_model_for_ticker(ticker)
+        # A cache miss reads from disk and may torch.compile: keep it off the event loop
+        model, version = await run_in_threadpool(load_model_for_ticker, ticker)
     except FileNotFoundError:
         PREDICTION_COUNTER.labels(ticker=ticker, model_version="error_not_found").inc()
         raise HTTPException(status_code=404, detail=f"Model for ticker {ticker} not found")
@@ -144,31 +215,19 @@ async def predict(request: PredictionRequest):
         raise HTTPException(status_code=500, detail="Internal error loading model")
     
     try:
-        # Prepare input
-        # N-BEATS expects (Batch, Seq, 1) and (Batch, Seq, 1) for mask
-        insample_y = torch.tensor(request.data).float().view(1, 60, 1)
-        insample_mask = torch.ones(1, 60, 1)
-        
-        batch = {
-            'insample_y': insample_y,
-            'insample_mask': insample_mask
-        }
-        
-        # OFF-LOAD CPU BOUND INFERENCE TO THREADPOOL
-        # This prevents blocking the main Async Event Loop
-        with torch.no_grad():
-            forecast = await run_in_threadpool(model, batch) # Returns (1, Horizon)
-        
-        forecast_list = forecast.squeeze().tolist()
+        # N-BEATS expects (Batch, Seq, 1) for input and mask; the batcher stacks
+        # pending requests and runs the forward pass in the threadpool
+        forecast_list = await batcher.predict(ticker, model, request.data)
         
         # 2. Set Cache
         cache.set_forecast(ticker, request.data, forecast_list)
         
-        PREDICTION_COUNTER.labels(ticker=ticker, model_version="N-BEATS-FP32").inc()
+        PREDICTION_COUNTER.labels(ticker=ticker, model_version=version).inc()
             
         return PredictionResponse(
             ticker=ticker,
-            forecast=forecast_list
+            forecast=forecast_list,
+            model_version=version
         )
         
     except Exception as e:
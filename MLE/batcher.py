@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Dict, List
+import torch
+from starlette.concurrency import run_in_threadpool
+from model_io import predict_window
+
+logger = logging.getLogger(__name__)
+
+# Requests for the same ticker arriving within this window share one forward pass
+BATCH_WINDOW = 0.005
+MAX_BATCH = 32
+
+
+def _forward(model, insample_y: torch.Tensor) -> List[List[float]]:
+    """Run one batched N-BEATS forward pass on raw closes (blocking, called in threadpool)"""
+    # no_grad is thread-local, so it must be entered in the worker thread
+    with torch.no_grad():
+        return predict_window(model, insample_y).tolist()
+
+
+class PredictionBatcher:
+    """Micro-batching queue per ticker in front of the model forward pass"""
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    async def predict(self, ticker: str, model, data: List[float]) -> List[float]:
+        """Queue one input window and wait for its forecast"""
+        queue = self._queues.get(ticker)
+        if queue is None:
+            # Worker started lazily on the first request for this ticker
+            queue = self._queues[ticker] = asyncio.Queue()
+            self._workers[ticker] = asyncio.create_task(self._run(queue))
+
+        insample_y = torch.tensor(data, dtype=torch.float32).view(-1, 1)
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((model, insample_y, future))
+        return await future
+
+    async def stop(self):
+        """Cancel all workers (call from the FastAPI shutdown event)"""
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.window
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Model of the first request; the cache may have reloaded it since
+            model = batch[0][0]
+            try:
+                stacked = torch.stack([x for _, x, _ in batch])  # (B, 60, 1)
+                results = await run_in_threadpool(_forward, model, stacked)
+            except Exception as e:
+                logger.error(f"Batched forward failed ({len(batch)} requests): {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), forecast in zip(batch, results):
+                if not future.done():  # Caller went away otherwise
+                    future.set_result(forecast)
@@ -2,10 +2,16 @@
 import redis
 import json
 import logging
+import xxhash
+import numpy as np
 from typing import Optional, List, Dict
 
 logger = logging.getLogger(__name__)
 
+def _hash(data: List[float]) -> str:
+    """Hash the raw float64 buffer of the input window (stable across processes)"""
+    return xxhash.xxh3_64_hexdigest(np.asarray(data, dtype=np.float64).tobytes())
+
 class PredictionCache:
     def __init__(self, host='localhost', port=6379, db=0, ttl=3600):
         """
@@ -31,9 +37,8 @@ class PredictionCache:
         if not self.enabled:
             return None
         
-        # Simple hash of the input data to ensure we return cache only for same input
-        data_hash = hash(tuple(data))
-        key = self._get_key(ticker, str(data_hash))
+        # Hash of the input data to ensure we return cache only for same input
+        key = self._get_key(ticker, _hash(data))
         
         try:
             val = self.redis.get(key)
@@ -49,8 +54,7 @@ class PredictionCache:
         if not self.enabled:
             return
             
-        data_hash = hash(tuple(data))
-        key = self._get_key(ticker, str(data_hash))
+        key = self._get_key(ticker, _hash(data))
         
         try:
             self.redis.setex(key, self.ttl, json.dumps(forecast))
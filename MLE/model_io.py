@@ -0,0 +1,338 @@
+import io
+import os
+import pickle
+import logging
+import torch
+import numpy as np
+import torch.nn as nn
+from typing import Dict
+
+# Optional: ONNX Runtime serving of the .onnx exports
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+INPUT_SIZE = 60  # Lookback window the models were trained with
+# Batch sizes an export must reproduce before it is saved: single requests, an odd size,
+# and a full batcher flush (batcher.MAX_BATCH)
+PARITY_BATCH_SIZES = (1, 3, 32)
+
+class CPU_Unpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == 'torch.storage' and name == '_load_from_bytes':
+            return lambda b: torch.load(io.BytesIO(b), map_location='cpu')
+        else:
+            return super().find_class(module, name)
+
+def load_pickled_model(path: str):
+    """Unpickle a NeuralForecast model and return the core N-BEATS module (FP32, eval)"""
+    with open(path, 'rb') as f:
+        model_data = CPU_Unpickler(f).load()
+
+    # Extract model from NeuralForecast wrapper if needed
+    if isinstance(model_data, dict):
+        model = model_data.get('model') or model_data
+    else:
+        model = model_data
+
+    if hasattr(model, 'models'):
+        core_model = model.models[0]
+    else:
+        core_model = model
+
+    core_model.eval()
+    core_model.to('cpu')
+    return core_model
+
+def load_checkpoint(path: str):
+    """Rebuild an N-BEATS module from a state_dict checkpoint written by scripts/retrain.py"""
+    from neuralforecast.models import NBEATS
+
+    checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+    core_model = NBEATS(**checkpoint['config'])
+    core_model.load_state_dict(checkpoint['state_dict'])
+    core_model.eval()
+    return core_model
+
+def load_core_model(path: str):
+    """FP32 core module from a .ckpt checkpoint or a legacy NeuralForecast pickle"""
+    if path.endswith(".ckpt"):
+        return load_checkpoint(path)
+    return load_pickled_model(path)
+
+def quantize(core_model):
+    """Dynamic INT8: weights quantized once, activations quantized per call"""
+    return torch.ao.quantization.quantize_dynamic(
+        core_model, {nn.Linear}, dtype=torch.qint8
+    )
+
+def bf16_supported() -> bool:
+    """CPU has native BF16 matmul (AVX512-BF16); elsewhere BF16 is emulated and slower than FP32"""
+    check = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(check and check())
+
+def to_bf16(core_model):
+    """Cast the weights to bfloat16 (halves the bytes read per forward pass)"""
+    return core_model.to(dtype=torch.bfloat16)
+
+def input_dtype(model) -> torch.dtype:
+    """dtype the model expects its inputs in (BF16 models carry BF16 parameters)"""
+    param = next(iter(model.parameters()), None)
+    if param is not None and param.is_floating_point():
+        return param.dtype
+    return torch.float32
+
+def model_input_size(core_model) -> int:
+    return getattr(core_model, 'input_size', INPUT_SIZE)
+
+def example_batch(batch_size: int = 2, dtype: torch.dtype = torch.float32, input_size: int = INPUT_SIZE) -> dict:
+    insample_y = torch.randn(batch_size, input_size, 1, dtype=dtype)
+    return {'insample_y': insample_y, 'insample_mask': torch.ones_like(insample_y)}
+
+# neuralforecast's TemporalNorm epsilon (scaler_type='standard')
+SCALER_EPS = 1e-6
+# Scalers predict_window can reproduce outside of nf.predict
+SUPPORTED_SCALERS = ('identity', 'standard')
+
+def model_scaler_type(model) -> str:
+    """scaler_type the model was trained with: the hparams of an eager NBEATS module, or the value
+    stored in a TorchScript/ONNX export (see save_torchscript/save_onnx). 'identity' if unrecorded."""
+    scaler_type = getattr(model, 'scaler_type', None)
+    if scaler_type is None:
+        hparams = getattr(model, 'hparams', None)
+        scaler_type = hparams.get('scaler_type') if hparams is not None else None
+    return scaler_type or 'identity'
+
+def predict_window(model, insample_y: torch.Tensor) -> torch.Tensor:
+    """Forecast raw-price windows (B, input_size, 1) -> (B, h) in price units.
+    nf.predict applies the model's scaler (BaseModel._normalization) around forward(), not forward()
+    itself, so a 'standard' window is standardized here and the forecast mapped back with the same
+    per-window mean/std; 'identity' models get the raw window (call under torch.no_grad())."""
+    scaler_type = model_scaler_type(model)
+    if scaler_type not in SUPPORTED_SCALERS:
+        raise ValueError(f"Unsupported scaler_type {scaler_type!r} (expected one of {SUPPORTED_SCALERS})")
+    insample_y = insample_y.float()
+    batch_size = insample_y.shape[0]
+    if scaler_type == 'identity':
+        forecast = model({'insample_y': insample_y.to(input_dtype(model)), 'insample_mask': torch.ones_like(insample_y)})
+        # Back to FP32 before serializing (BF16 models return BF16)
+        return forecast.float().reshape(batch_size, -1)
+
+    mean = insample_y.mean(dim=1, keepdim=True)
+    std = ((insample_y - mean) ** 2).mean(dim=1, keepdim=True).sqrt()
+    std = torch.where(std == 0, torch.ones_like(std), std) + SCALER_EPS
+
+    scaled = ((insample_y - mean) / std).to(input_dtype(model))
+    forecast = model({'insample_y': scaled, 'insample_mask': torch.ones_like(scaled)})
+    # Back to FP32 before unscaling (BF16 models return BF16)
+    forecast = forecast.float().reshape(batch_size, -1, 1)
+    return (forecast * std + mean).reshape(batch_size, -1)
+
+def check_batch_parity(exported, reference, input_size: int = INPUT_SIZE, atol: float = 1e-4, label: str = "Export"):
+    """Raise ValueError unless `exported` matches `reference` at every PARITY_BATCH_SIZES batch size.
+    Catches graphs that baked the example batch size in as a constant."""
+    for batch_size in PARITY_BATCH_SIZES:
+        batch = example_batch(batch_size, input_size=input_size)
+        try:
+            with torch.no_grad():
+                # Compared per row: the export may drop the trailing output-feature axis
+                diff = (exported(batch).reshape(batch_size, -1) - reference(batch).reshape(batch_size, -1))
+                diff = diff.abs().max().item()
+        except Exception as e:
+            raise ValueError(f"{label} fails at batch size {batch_size}: {e}") from e
+        if diff > atol:
+            raise ValueError(f"{label} differs from eager model at batch size {batch_size} (max abs diff {diff:.2e})")
+
+class NBEATSForward(nn.Module):
+    """NBEATS.forward (point forecast) over the fitted blocks, as a plain nn.Module.
+    Scripting, tracing or torch.export of the LightningModule itself reads its `trainer`
+    property, which raises outside of fit ("NBEATS is not attached to a Trainer")."""
+
+    def __init__(self, core_model):
+        super().__init__()
+        if getattr(core_model, 'decompose_forecast', False):
+            raise ValueError("Models with decompose_forecast=True are not exported")
+        self.blocks = core_model.blocks
+
+    def forward(self, windows_batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        insample_y = windows_batch['insample_y'].squeeze(-1)
+        insample_mask = windows_batch['insample_mask'].squeeze(-1)
+
+        residuals = insample_y.flip(dims=(-1,))  # Backcast init
+        insample_mask = insample_mask.flip(dims=(-1,))
+        forecast = insample_y[:, -1:, None]  # Level with Naive1
+        for block in self.blocks:
+            backcast, block_forecast = block(insample_y=residuals)
+            residuals = (residuals - backcast) * insample_mask
+            forecast = forecast + block_forecast
+        return forecast
+
+def trace(core_model):
+    """TorchScript of the (quantized) model's NBEATSForward: scripted if possible, else traced on a
+    (B, input_size, 1) batch. NBEATS bases reshape with len(x), which tracing records as a constant,
+    so a traced graph may only work at the example batch size (save_torchscript rejects those)."""
+    module = NBEATSForward(core_model).eval()
+    try:
+        return torch.jit.script(module)
+    except Exception as e:
+        logger.info(f"torch.jit.script failed ({e}), falling back to tracing")
+    with torch.no_grad():
+        return torch.jit.trace(module, (example_batch(input_size=model_input_size(core_model)),), strict=False)
+
+def compile_model(core_model, mode: str = "default", warm_batch_sizes: tuple = (1,)):
+    """torch.compile an eager module with a dynamic batch dimension, compiling on warm-up
+    batches of each warm_batch_sizes size (falls back to eager). Blocking: call off the event loop."""
+    if not hasattr(torch, "compile"):
+        return core_model
+    if mode == "reduce-overhead" and not torch.cuda.is_available():
+        # reduce-overhead means CUDA graphs, which do nothing for this CPU-only server
+        logger.warning(f"torch.compile mode {mode!r} needs CUDA, using 'default'")
+        mode = "default"
+    try:
+        # dynamic=True: the batcher stacks 1..MAX_BATCH requests, one graph instead of one per size
+        compiled = torch.compile(core_model, mode=mode, dynamic=True)
+        # Compilation is lazy: run it now (for every size the batcher sends) instead of on a request
+        dtype = input_dtype(core_model)
+        with torch.no_grad():
+            for batch_size in warm_batch_sizes:
+                compiled(example_batch(batch_size, dtype, model_input_size(core_model)))
+        return compiled
+    except Exception as e:
+        logger.warning(f"torch.compile failed ({e}), serving the eager model")
+        return core_model
+
+def save_torchscript(core_model, pt_path: str, atol: float = 1e-4):
+    """Quantize + script/trace an FP32 core module and save it, only if it matches eager mode
+    at every PARITY_BATCH_SIZES batch size (raises ValueError otherwise, nothing is left on disk)"""
+    core_model.eval()
+    quantized = quantize(core_model)
+    input_size = model_input_size(core_model)
+    try:
+        traced = trace(quantized)
+    except Exception as e:
+        raise ValueError(f"TorchScript export failed: {e}") from e
+    check_batch_parity(traced, quantized, input_size, atol, "TorchScript export")
+
+    # Exports lose the NBEATS hparams, so the scaler predict_window needs is stored in the archive
+    try:
+        traced.save(pt_path, _extra_files={'scaler_type': model_scaler_type(core_model)})
+    except Exception as e:
+        if os.path.exists(pt_path):
+            os.remove(pt_path)
+        raise ValueError(f"TorchScript save failed: {e}") from e
+    # Check again what the API will actually serve: the saved file, frozen by load_torchscript
+    try:
+        check_batch_parity(load_torchscript(pt_path), quantized, input_size, atol, "Saved TorchScript")
+    except ValueError:
+        os.remove(pt_path)
+        raise
+    return traced
+
+ONNX_INPUTS = ['insample_y', 'insample_mask']
+
+def save_onnx(core_model, onnx_path: str, atol: float = 1e-4) -> str:
+    """Export an FP32 core module to ONNX with a symbolic batch dimension and save it, only if
+    onnxruntime matches eager mode at every PARITY_BATCH_SIZES batch size (raises ValueError otherwise)"""
+    if ort is None:
+        raise ValueError("onnxruntime is required to validate the ONNX export")
+    core_model.eval()
+    input_size = model_input_size(core_model)
+
+    # The dynamo exporter keeps len(x) symbolic; the legacy exporter's dynamic_axes only
+    # renamed the axis while the reshape target stayed the traced constant
+    batch_dim = torch.export.Dim("batch", max=1024)
+    try:
+        program = torch.onnx.export(
+            NBEATSForward(core_model).eval(), (example_batch(input_size=input_size),), dynamo=True,
+            input_names=ONNX_INPUTS, output_names=['forecast'],
+            dynamic_shapes=({name: {0: batch_dim} for name in ONNX_INPUTS},)
+        )
+        # Exports lose the NBEATS hparams, so the scaler predict_window needs goes in the metadata
+        program.model.metadata_props['scaler_type'] = model_scaler_type(core_model)
+        program.save(onnx_path)
+    except Exception as e:
+        if os.path.exists(onnx_path):
+            os.remove(onnx_path)
+        raise ValueError(f"ONNX export failed: {e}") from e
+
+    try:
+        check_batch_parity(OnnxModel(onnx_path), core_model, input_size, atol, "ONNX export")
+    except ValueError:
+        os.remove(onnx_path)
+        raise
+    return onnx_path
+
+class OnnxModel:
+    """ONNX Runtime session with the same call signature as the torch module (dict batch in, tensor out)"""
+
+    def __init__(self, path: str):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1  # Same one-thread-per-request policy as torch
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.scaler_type = self.session.get_modelmeta().custom_metadata_map.get('scaler_type', 'identity')
+        # Graph input -> batch key (by name, else position: inputs the graph never reads are pruned)
+        self.feeds = [
+            (node.name, next((key for key in ONNX_INPUTS if node.name.endswith(key)), ONNX_INPUTS[i]))
+            for i, node in enumerate(self.session.get_inputs())
+        ]
+
+    def __call__(self, windows_batch: dict) -> torch.Tensor:
+        feeds = {name: windows_batch[key].numpy().astype(np.float32, copy=False) for name, key in self.feeds}
+        return torch.from_numpy(self.session.run(None, feeds)[0])
+
+    def parameters(self):
+        # No torch parameters: inputs stay FP32 (see input_dtype)
+        return iter(())
+
+def load_torchscript(path: str):
+    """Load a TorchScript export and optimize it for inference (frozen graph)"""
+    extra_files = {'scaler_type': ''}
+    scripted = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    scripted.eval()
+    try:
+        optimized = torch.jit.optimize_for_inference(scripted)
+    except Exception as e:
+        logger.warning(f"optimize_for_inference failed for {path} ({e}), using unoptimized graph")
+        optimized = scripted
+    scaler_type = extra_files['scaler_type']
+    if isinstance(scaler_type, bytes):
+        scaler_type = scaler_type.decode()
+    # Plain Python attribute read by model_scaler_type (exports written before it was stored: identity)
+    optimized.scaler_type = scaler_type or 'identity'
+    return optimized
+
+def serving_extensions(bf16: bool = False) -> tuple:
+    """Artifact formats in order of preference: ONNX export (if onnxruntime is installed),
+    TorchScript export, state_dict checkpoint, legacy pickle. Exports are not BF16, so BF16 skips them."""
+    if bf16:
+        return (".ckpt", ".pkl")
+    if ort is not None:
+        return (".onnx", ".pt", ".ckpt", ".pkl")
+    return (".pt", ".ckpt", ".pkl")
+
+def find_model_path(models_dir: str, ticker: str, extensions: tuple) -> str:
+    """First existing artifact for the ticker in `extensions` order (last candidate if none exist).
+    Fixed order, not mtime: checkout, Docker COPY and the retrain commit give all files about the
+    same mtime. scripts/retrain.py removes exports that fail validation, so a present export is current."""
+    paths = [os.path.join(models_dir, f"{ticker}_nbeats{ext}") for ext in extensions]
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return paths[-1]
+
+def is_eager(path: str) -> bool:
+    """Checkpoints and pickles load as eager torch modules (exports are already graphs)"""
+    return path.endswith((".ckpt", ".pkl"))
+
+def load_for_serving(path: str, bf16: bool = False):
+    """Inference-ready model: ONNX session, TorchScript graph, or an INT8 (or BF16) eager module"""
+    if path.endswith(".onnx"):
+        return OnnxModel(path)
+    if path.endswith(".pt"):
+        return load_torchscript(path)
+    core_model = load_core_model(path)
+    return to_bf16(core_model) if bf16 else quantize(core_model)
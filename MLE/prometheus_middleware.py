@@ -26,6 +26,11 @@ PREDICTION_COUNTER = Counter(
     ["ticker", "model_version"]
 )
 
+MODEL_EVICTION_COUNTER = Counter(
+    "model_cache_evictions_total",
+    "Models evicted from the in-memory LRU model cache"
+)
+
 class PrometheusMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request, call_next):
         start_time = time.perf_counter()
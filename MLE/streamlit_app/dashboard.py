@@ -1,4 +1,7 @@
 
+import os
+import sys
+import base64
 import streamlit as st
 import requests
 import pandas as pd
@@ -6,7 +9,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import yfinance as yf
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 
 # Page Config
 st.set_page_config(
@@ -37,6 +40,111 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# --- CACHED FETCHES ---
+# Reruns (button clicks, slider moves) reuse these instead of hitting Yahoo / the API again
+@st.cache_data(ttl=900, show_spinner=False)
+def load_history(ticker: str, as_of: str, days: int = 365):
+    """Daily (dates, closes) up to `as_of` (part of the cache key so entries roll over each day).
+    Extracted to numpy once here, so reruns index plain arrays instead of pandas."""
+    end_date = datetime.fromisoformat(as_of) + timedelta(days=1)
+    start_date = end_date - timedelta(days=days)
+    history = yf.Ticker(ticker).history(start=start_date, end=end_date)
+    if history.empty:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+    # Naive datetime64 (exchange-local dates) instead of an object array of tz-aware Timestamps
+    return history.index.tz_localize(None).to_numpy(), history['Close'].to_numpy(dtype=np.float64)
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One pooled keep-alive session shared by all reruns and users"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class ForecastAPIError(Exception):
+    pass
+
+@st.cache_data(ttl=300, show_spinner=False)
+def call_forecast(api_url: str, ticker: str, input_data: tuple) -> dict:
+    """POST the input window to the API (raises on errors so failures are not cached)"""
+    # 60 float32 values as base64 (~320 bytes) instead of a JSON list of floats
+    data_b64 = base64.b64encode(np.asarray(input_data, dtype="<f4").tobytes()).decode()
+    resp = get_session().post(api_url, json={"ticker": ticker, "data_b64": data_b64}, timeout=10)
+    if resp.status_code != 200:
+        raise ForecastAPIError(resp.text)
+    return resp.json()
+
+@st.cache_resource(max_entries=32)
+def build_forecast_fig(ticker: str, days: int, last_date_iso: str, hist_tuple: tuple, forecast_tuple: tuple):
+    """Forecast figure for one (ticker, horizon, last date) - reused across reruns.
+    hist_tuple is (dates, closes) for the plotted history, forecast_tuple is (dates, values)."""
+    last_date = pd.Timestamp(last_date_iso)
+    hist_dates, hist_close = hist_tuple
+    # Array form so matplotlib skips its per-element list conversion
+    forecast_dates = pd.DatetimeIndex(forecast_tuple[0])
+    final_forecast = np.asarray(forecast_tuple[1], dtype=np.float32)
+    
+    # Create Plot
+    fig, ax = plt.subplots(figsize=(12, 6))
+    
+    # Plot History (Last 90 days for clarity)
+    ax.plot(hist_dates, hist_close, label='Actual Price', color='blue', linewidth=2)
+    
+    # Plot Prediction
+    ax.plot(forecast_dates, final_forecast, label='N-BEATS Prediction', color='red', linewidth=2, marker='.', markersize=8)
+    
+    # connecting line
+    ax.plot([hist_dates[-1], forecast_dates[0]], [hist_close[-1], final_forecast[0]], color='red', linestyle='--')
+    
+    # Highlight Forecast Area
+    ax.axvspan(forecast_dates[0], forecast_dates[-1], color='yellow', alpha=0.1, label='Forecast Period')
+    ax.axvline(x=last_date, color='green', linestyle=':', label='Forecast Start')
+    
+    # Styling
+    ax.set_title(f"{ticker} Price Forecast - Next {days} Days", fontsize=16, fontweight='bold')
+    ax.set_ylabel("Price (USD)")
+    ax.legend(loc='upper left')
+    ax.grid(True, linestyle='--', alpha=0.5)
+    
+    # Format Date axis
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    ax.tick_params(axis='x', labelrotation=45)
+    
+    return fig
+
+# --- LOCAL INFERENCE (optional, skips the API hop) ---
+MLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(MLE_DIR, "models")
+sys.path.insert(0, MLE_DIR)
+
+@st.cache_resource(show_spinner="Loading model...")
+def load_model(ticker: str):
+    """Model loaded once per Streamlit process and shared by all sessions (ONNX/TorchScript when exported)"""
+    # torch is only imported when local inference is used
+    import torch
+    from model_io import serving_extensions, find_model_path, load_for_serving, example_batch
+
+    path = find_model_path(MODELS_DIR, ticker, serving_extensions())
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model for {ticker} not found at {path}")
+    model = load_for_serving(path)
+    # Warm-up forward so the first real forecast does not pay kernel init
+    with torch.no_grad():
+        model(example_batch(1))
+    return model
+
+def local_forecast(ticker: str, input_data: tuple) -> dict:
+    """Same response shape as the API's /predict, computed in-process"""
+    import torch
+    from model_io import predict_window
+
+    insample_y = torch.tensor(input_data, dtype=torch.float32).view(1, -1, 1)
+    with torch.no_grad():
+        forecast = predict_window(load_model(ticker), insample_y)
+    return {"ticker": ticker, "forecast": forecast.reshape(-1).tolist(), "model_version": "N-BEATS-LOCAL"}
+
 # Title
 st.markdown('<div class="main-title">🚀 N-BEATS Stock Forecaster</div>', unsafe_allow_html=True)
 
@@ -45,87 +153,71 @@ st.sidebar.header("Configuration")
 ticker = st.sidebar.text_input("Ticker Symbol", value="NVDA").upper()
 days_to_predict = st.sidebar.slider("Forecast Horizon (Days)", min_value=1, max_value=30, value=30)
 api_url = st.sidebar.text_input("API URL", value="http://localhost:8002/predict")
+local_inference = st.sidebar.checkbox("Local inference (skip API)", value=False)
 
 # Main Logic
 if st.button("Generate Forecast"):
     with st.spinner(f"Fetching data and forecasting for {ticker}..."):
         try:
             # 1. Get History from YFinance (Last 1 year)
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=365)
-            
-            stock = yf.Ticker(ticker)
-            history = stock.history(start=start_date, end=end_date)
+            dates, close = load_history(ticker, date.today().isoformat())
             
-            if history.empty:
+            if close.size == 0:
                 st.error(f"No data found for {ticker}")
                 st.stop()
                 
             # Prepare Input for API (Last 60 days of Close)
-            if len(history) < 60:
+            if close.size < 60:
                 st.error("Not enough historical data (need at least 60 days)")
                 st.stop()
                 
-            input_data = history['Close'].values[-60:].tolist()
-            
-            # 2. Call API
-            payload = {
-                "ticker": ticker,
-                "data": input_data
-            }
-            
-            resp = requests.post(api_url, json=payload)
-            
-            if resp.status_code != 200:
-                st.error(f"API Error: {resp.text}")
+            # Raw closes: the serving side standardizes each window and unscales the forecast
+            # (model_io.predict_window, as scaler_type='standard' does in nf.predict).
+            # One bulk float64 -> tuple conversion, no per-element loop.
+            input_data = tuple(close[-60:].tolist())
+            
+            # 2. Call API (full 30-day forecast; the slider only slices it below)
+            try:
+                if local_inference:
+                    result = local_forecast(ticker, input_data)
+                else:
+                    result = call_forecast(api_url, ticker, input_data)
+            except ForecastAPIError as e:
+                st.error(f"API Error: {e}")
+                st.stop()
+            except FileNotFoundError as e:
+                st.error(str(e))
                 st.stop()
                 
-            prediction = resp.json().get("forecast", [])
-            model_ver = resp.json().get("model_version", "Unknown")
+            prediction = result.get("forecast", [])
+            model_ver = result.get("model_version", "Unknown")
             
             # Slice prediction based on slider
             final_forecast = prediction[:days_to_predict]
             
             # 3. Visualization
-            last_date = history.index[-1]
-            forecast_dates = [last_date + timedelta(days=i+1) for i in range(len(final_forecast))]
-            
-            # Create Plot
-            fig, ax = plt.subplots(figsize=(12, 6))
-            
-            # Plot History (Last 90 days for clarity)
-            plot_history = history.iloc[-90:]
-            ax.plot(plot_history.index, plot_history['Close'], label='Actual Price', color='blue', linewidth=2)
-            
-            # Plot Prediction
-            ax.plot(forecast_dates, final_forecast, label='N-BEATS Prediction', color='red', linewidth=2, marker='.', markersize=8)
-            
-            # connecting line
-            ax.plot([plot_history.index[-1], forecast_dates[0]], [plot_history['Close'].iloc[-1], final_forecast[0]], color='red', linestyle='--')
-            
-            # Highlight Forecast Area
-            ax.axvspan(forecast_dates[0], forecast_dates[-1], color='yellow', alpha=0.1, label='Forecast Period')
-            ax.axvline(x=last_date, color='green', linestyle=':', label='Forecast Start')
-            
-            # Styling
-            ax.set_title(f"{ticker} Price Forecast - Next {days_to_predict} Days", fontsize=16, fontweight='bold')
-            ax.set_ylabel("Price (USD)")
-            ax.legend(loc='upper left')
-            ax.grid(True, linestyle='--', alpha=0.5)
-            
-            # Format Date axis
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            plt.xticks(rotation=45)
+            last_date = pd.Timestamp(dates[-1])
+            last_price = close[-1]
+            forecast_dates = pd.date_range(last_date + pd.Timedelta(days=1), periods=len(final_forecast), freq='D')
+            
+            # Plot History (Last 90 days for clarity); tuples so the figure cache can hash them
+            fig = build_forecast_fig(
+                ticker,
+                days_to_predict,
+                last_date.isoformat(),
+                (tuple(dates[-90:]), tuple(close[-90:].tolist())),
+                (tuple(forecast_dates), tuple(final_forecast))
+            )
             
             st.pyplot(fig)
             
             # Metrics
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Current Price", f"${history['Close'].iloc[-1]:.2f}")
+                st.metric("Current Price", f"${last_price:.2f}")
             with col2:
                 final_price = final_forecast[-1]
-                delta = final_price - history['Close'].iloc[-1]
+                delta = final_price - last_price
                 st.metric(f"Price in {days_to_predict} Days", f"${final_price:.2f}", f"{delta:.2f}")
             with col3:
                 st.info(f"Model: {model_ver}")
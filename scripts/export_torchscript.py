@@ -0,0 +1,45 @@
+
+import os
+import sys
+import glob
+import logging
+import neuralforecast  # noqa: F401 (classes needed to unpickle the models)
+
+# Setup Logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Determine base directory (one level up from this script)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, "MLE", "models")
+
+sys.path.insert(0, os.path.join(BASE_DIR, "MLE"))
+from model_io import load_core_model, save_torchscript
+
+def export(model_path: str) -> str:
+    """Trace one saved model (INT8 quantized) and save it next to the source as .pt"""
+    pt_path = os.path.splitext(model_path)[0] + ".pt"
+    save_torchscript(load_core_model(model_path), pt_path)
+    logger.info(f"💾 TorchScript saved to {pt_path}")
+    return pt_path
+
+def main():
+    logger.info("🚀 Exporting N-BEATS models to TorchScript")
+
+    # Checkpoints from scripts/retrain.py, legacy pickles only where no checkpoint exists
+    ckpt_paths = glob.glob(os.path.join(MODELS_DIR, "*_nbeats.ckpt"))
+    pkl_paths = [
+        p for p in glob.glob(os.path.join(MODELS_DIR, "*_nbeats.pkl"))
+        if not os.path.exists(p[:-len(".pkl")] + ".ckpt")
+    ]
+    
+    for model_path in sorted(ckpt_paths + pkl_paths):
+        try:
+            export(model_path)
+        except Exception as e:
+            logger.error(f"❌ Failed to export {os.path.basename(model_path)}: {e}")
+
+    logger.info("🎉 Export Finished")
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,256 @@
 
 import os
-import time
+import sys
+import shutil
 import logging
+import functools
+import multiprocessing
 # IMPORTS: NeuralForecast MUST be imported before pandas/yfinance to avoid DLL load errors
 from neuralforecast import NeuralForecast
 from neuralforecast.models import NBEATS
 import pandas as pd
 import yfinance as yf
 import torch
-import numpy as np
-import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Optional: physical core count (hosts without SMT, CI runners)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def physical_cores():
+    """Physical cores this process may use: psutil's count capped by the CPU affinity mask,
+    else half the logical CPUs (assumes 2-way SMT)"""
+    logical = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    physical = psutil.cpu_count(logical=False) if psutil is not None else None
+    if not physical:
+        return max(1, logical // 2)
+    return max(1, min(physical, logical))
+
+# Threads: physical cores only (hyperthreads thrash cache on the matmul stack), no interop pool.
+# Worker processes split these cores further (see main).
+PHYSICAL_CORES = physical_cores()
+torch.set_num_threads(PHYSICAL_CORES)
+torch.set_num_interop_threads(1)
+
 # Constants
 TICKERS = ["NVDA", "MSFT", "GOOGL", "AMZN", "META", "TSLA", "AAPL", "AMD", "INTC", "TSM"]
 
-# Determine base directory (one level up from this script)
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MODELS_DIR = os.path.join(BASE_DIR, "MLE", "models")
-HISTORY_YEARS = 2 # Training windowm this script)
+# Determine base directory (one level up from this script); MODELS_DIR can be redirected for CI
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MODELS_DIR = os.path.join(BASE_DIR, "MLE", "models")
+MODELS_DIR = os.environ.get("MODELS_DIR", os.path.join(BASE_DIR, "MLE", "models"))
 HISTORY_YEARS = 2 # Training window
 
-def fetch_data(ticker):
-    """Fetch last N years of data from yfinance"""
+# Shared model export helpers (quantize + TorchScript trace) live with the API
+sys.path.insert(0, os.path.join(BASE_DIR, "MLE"))
+from model_io import save_torchscript, save_onnx
+
+# Model Configuration (Same as DS Phase); saved with the weights so the API can rebuild NBEATS
+MODEL_CONFIG = {
+    'h': 30, # Forecast horizon
+    'input_size': 60, # Lookback window
+    'scaler_type': 'standard'
+}
+MAX_STEPS = 500 # Training from scratch
+WARM_START_STEPS = 75 # Fine-tuning yesterday's weights on the new data
+
+@functools.lru_cache(maxsize=None)
+def detect_accelerator():
+    """Lightning trainer kwargs for the best available device (CUDA > MPS > CPU).
+    Called lazily (not at import) so probing CUDA happens in the process that trains."""
+    if torch.cuda.is_available():
+        # Mixed precision only affects the fit; saved weights stay FP32.
+        # bf16 needs Ampere or newer; older GPUs (T4, V100) get FP16 autocast instead
+        precision = 'bf16-mixed' if torch.cuda.is_bf16_supported() else '16-mixed'
+        return {'accelerator': 'gpu', 'devices': 1, 'precision': precision}
+    if getattr(torch.backends, 'mps', None) is not None and torch.backends.mps.is_available():
+        return {'accelerator': 'mps', 'devices': 1}
+    return {'accelerator': 'cpu'}
+
+def fetch_all(tickers):
+    """Fetch last N years of data for all tickers in one yfinance request"""
     end_date = datetime.now()
     start_date = end_date - timedelta(days=HISTORY_YEARS*365)
     
-    logger.info(f"Fetching data for {ticker}...")
-    df = yf.download(ticker, start=start_date, end=end_date, progress=False)
+    logger.info(f"Fetching data for {len(tickers)} tickers...")
+    raw = yf.download(tickers, start=start_date, end=end_date, group_by='ticker', threads=True, progress=False)
     
-    if df.empty:
-        raise ValueError(f"No data found for {ticker}")
+    frames = {}
+    for ticker in tickers:
+        if ticker not in raw.columns.get_level_values(0):
+            logger.error(f"❌ No data found for {ticker}")
+            continue
+        
+        close = raw[ticker]['Close'].dropna()
+        if close.empty:
+            logger.error(f"❌ No data found for {ticker}")
+            continue
         
-    df = df.reset_index()
-    # NeuralForecast expects columns: ds, y, unique_id
-    data = pd.DataFrame()
-    data['ds'] = df['Date']
-    data['y'] = df['Close']
-    data['unique_id'] = ticker
+        # NeuralForecast expects columns: ds, y, unique_id (built in one go, no reset_index copy)
+        frames[ticker] = pd.DataFrame({
+            'ds': close.index.values,
+            'y': close.to_numpy(copy=False),
+            'unique_id': ticker
+        })
+    
+    return frames
+
+def load_previous_weights(ticker):
+    """state_dict of the last saved checkpoint, if it was trained with the current config"""
+    prev_path = os.path.join(MODELS_DIR, f"{ticker}_nbeats.ckpt")
+    if not os.path.exists(prev_path):
+        return None
     
-    return data
+    try:
+        checkpoint = torch.load(prev_path, map_location='cpu', weights_only=True)
+    except Exception as e:
+        logger.warning(f"Could not read previous checkpoint for {ticker}: {e}")
+        return None
+    
+    if checkpoint.get('config') != MODEL_CONFIG:
+        logger.info(f"Model config changed for {ticker}, training from scratch")
+        return None
+    return checkpoint['state_dict']
 
 def train_model(data, ticker):
-    """Train N-BEATS model on data"""
-    logger.info(f"Training N-BEATS for {ticker}...")
+    """Train N-BEATS model on data (warm-started from the previous checkpoint when possible)"""
+    state_dict = load_previous_weights(ticker)
+    max_steps = MAX_STEPS if state_dict is None else WARM_START_STEPS
+    logger.info(f"Training N-BEATS for {ticker} ({'warm start' if state_dict is not None else 'from scratch'}, {max_steps} steps)...")
     
-    # Model Configuration (Same as DS Phase)
     model = NBEATS(
-        h=30, # Forecast horizon
-        input_size=60, # Lookback window
-        loss=NBEATS.mae,
-        max_steps=500, # Fast retraining
-        scaler_type='standard',
-        enable_progress_bar=True
+        **MODEL_CONFIG,
+        max_steps=max_steps,
+        enable_progress_bar=False, # tqdm redraws cost more than the short training steps
+        **detect_accelerator()
     )
+    if state_dict is not None:
+        # NeuralForecast deep-copies the model on init, so weights must be loaded before it
+        model.load_state_dict(state_dict)
     
     nf = NeuralForecast(models=[model], freq='D')
     nf.fit(df=data)
     return nf
 
+def write_atomic(write, path):
+    """Write via a temp file + os.replace so readers (the API) never see a partial artifact"""
+    tmp_path = path + ".tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def save_model(nf, ticker):
-    """Save model to disk with versioning"""
+    """Save model weights + config to disk with versioning; returns the names of the failed exports"""
+    # Only the NBEATS state_dict is kept (no trainer, optimizer or NeuralForecast wrapper);
+    # the API rebuilds the module from MODEL_CONFIG (see MLE/model_io.load_checkpoint)
+    # Export from CPU whatever device the fit ran on (the API and the trace are CPU-only)
+    core_model = nf.models[0].cpu()
+    checkpoint = {
+        'state_dict': core_model.state_dict(),
+        'config': MODEL_CONFIG
+    }
+    
     # 1. Save 'latest' version for API
-    save_path = os.path.join(MODELS_DIR, f"{ticker}_nbeats.pkl")
+    save_path = os.path.join(MODELS_DIR, f"{ticker}_nbeats.ckpt")
     os.makedirs(MODELS_DIR, exist_ok=True)
     
-    nf.save(save_path, model_index=None, overwrite=True, save_dataset=False)
+    write_atomic(lambda path: torch.save(checkpoint, path), save_path)
     logger.info(f"💾 Model saved to {save_path}")
     
+    # Serving exports (ONNX for onnxruntime, INT8 TorchScript); the API picks by fixed format
+    # preference (model_io.find_model_path). Each export is written only if it passes its multi-batch
+    # parity check, so a failed export only costs that fast path: the API falls back.
+    failed_exports = []
+    for name, ext, export in (("ONNX", ".onnx", save_onnx), ("TorchScript", ".pt", save_torchscript)):
+        export_path = os.path.join(MODELS_DIR, f"{ticker}_nbeats{ext}")
+        try:
+            write_atomic(lambda path: export(core_model, path), export_path)
+            logger.info(f"⚡ {name} saved to {export_path}")
+        except Exception as e:
+            logger.error(f"❌ {name} export failed for {ticker}: {e}")
+            failed_exports.append(name)
+            if os.path.exists(export_path):
+                os.remove(export_path)  # A stale export would otherwise shadow the new checkpoint
+    
     # 2. Save 'versioned' backup (Simulated artifact store)
     # In real MLOps, this would go to S3/MLFlow
     date_str = datetime.now().strftime("%Y%m%d")
-    backup_path = os.path.join(MODELS_DIR, "archive", f"{ticker}_nbeats_{date_str}.pkl")
+    backup_path = os.path.join(MODELS_DIR, "archive", f"{ticker}_nbeats_{date_str}.ckpt")
     os.makedirs(os.path.dirname(backup_path), exist_ok=True)
     
-    # NeuralForecast save is a directory structure or pickle depending on usage.
-    # The .save method of NeuralForecast saves a directory.
-    # Our API expects a pickle of the wrapper or specific handling.
-    # Let's check how the API loads it. 
-    # API uses: `model_data = CPU_Unpickler(f).load()`
-    # If NeuralForecast.save() creates a folder, we might need to pickle the object manually 
-    # OR adjust the API to load from folder.
-    # The DS notebook likely used `pickle.dump`. Let's stick to that for compatibility.
-    
-    import pickle
-    with open(save_path, 'wb') as f:
-        pickle.dump(nf, f)
-        
-    shutil.copy(save_path, backup_path)
+    # Hardlink to 'latest': no second write. Safe because 'latest' is always replaced
+    # (new inode) rather than rewritten in place, so the archived bytes never change.
+    if os.path.exists(backup_path):
+        os.remove(backup_path)
+    try:
+        os.link(save_path, backup_path)
+    except OSError:
+        shutil.copy(save_path, backup_path)  # Filesystems without hardlinks
     logger.info(f"📦 Backup created at {backup_path}")
+    return failed_exports
+
+def _retrain_one(ticker, data, num_threads):
+    """Train and save one ticker (runs in a worker process); returns the failed export names"""
+    # Split cores between workers so torch/BLAS threads don't oversubscribe
+    torch.set_num_threads(num_threads)
+    
+    # 2. Training
+    nf_model = train_model(data, ticker)
+    
+    # 3. Model Registry (Local)
+    return save_model(nf_model, ticker)
 
 def main():
-    logger.info("🚀 Starting Daily Retraining Pipeline")
+    """Run the pipeline; exit status 1 if any ticker or serving export failed (after saving the rest)"""
+    accelerator = detect_accelerator()['accelerator']
+    logger.info(f"🚀 Starting Daily Retraining Pipeline (accelerator: {accelerator})")
     
-    for ticker in TICKERS:
-        try:
-            # 1. Data Ingestion
-            data = fetch_data(ticker)
-            
-            # 2. Training
-            nf_model = train_model(data, ticker)
-            
-            # 3. Model Registry (Local)
-            save_model(nf_model, ticker)
-            
-            logger.info(f"✅ Successfully updated {ticker}")
-            
-        except Exception as e:
-            logger.error(f"❌ Failed to retrain {ticker}: {e}")
+    # 1. Data Ingestion (single batched request for every ticker)
+    frames = fetch_all(TICKERS)
+    if not frames:
+        logger.error("❌ No data fetched, nothing to retrain")
+        return 1
+    
+    # Tickers are independent and fit is CPU-bound, so train them in separate processes
+    # A single GPU/MPS device is shared, so only CPU training fans out across processes
+    workers = min(len(frames), PHYSICAL_CORES) if accelerator == 'cpu' else 1
+    num_threads = max(1, PHYSICAL_CORES // workers)
+    
+    # spawn, not fork: a CUDA context initialized in the parent is unusable in forked children
+    # (and forking a process holding torch's thread pools can deadlock them)
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=spawn) as executor:
+        futures = {
+            executor.submit(_retrain_one, ticker, data, num_threads): ticker
+            for ticker, data in frames.items()
+        }
+        
+        failures = []
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                failed_exports = future.result()
+                logger.info(f"✅ Successfully updated {ticker}")
+                failures.extend(f"{ticker} {name} export" for name in failed_exports)
+            except Exception as e:
+                logger.error(f"❌ Failed to retrain {ticker}: {e}")
+                failures.append(f"{ticker} retrain")
             
+    if failures:
+        # Non-zero exit so CI shows the run as failed (the workflow still commits what was saved)
+        logger.error(f"❌ Pipeline finished with failures: {', '.join(sorted(failures))}")
+        return 1
     logger.info("🎉 Pipeline Finished")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,57 +1,140 @@
 
 import os
-import shutil
+import sys
 import logging
 # IMPORT FIX: NeuralForecast first
 from neuralforecast import NeuralForecast
 from neuralforecast.models import NBEATS
 import pandas as pd
-import yfinance as yf
-from datetime import datetime, timedelta
+import torch
+import pytest
 import pickle
+import numpy as np
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-MODELS_DIR = r"H:\coding\Portfolio\Stock_Forecasting\MLE\models"
-os.makedirs(MODELS_DIR, exist_ok=True)
-
-def test_pipeline():
-    ticker = "NVDA"
-    logger.info(f"🧪 Testing pipeline for {ticker}...")
-    
-    # 1. Fetch small data
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=100)
-    df = yf.download(ticker, start=start_date, end=end_date, progress=False)
-    df = df.reset_index()
-    data = pd.DataFrame()
-    data['ds'] = df['Date']
-    data['y'] = df['Close']
-    data['unique_id'] = ticker
-    
-    # 2. Train tiny model
-    model = NBEATS(
-        h=5,
-        input_size=10,
-        max_steps=1, # One step only
-        scaler_type='standard'
-    )
+# Determine base directory (one level up from this script); test artifacts go to pytest's tmp dirs,
+# never to the served MLE/models
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(BASE_DIR, "MLE"))
+from model_io import (
+    load_checkpoint, load_torchscript, save_torchscript, save_onnx, quantize,
+    example_batch, predict_window, model_scaler_type, PARITY_BATCH_SIZES
+)
+
+TICKER = "NVDA"
+# Tiny model: one training step is enough to exercise the pipeline
+TEST_CONFIG = {'h': 5, 'input_size': 10, 'scaler_type': 'standard'}
+
+@pytest.fixture(scope="session")
+def sample_data():
+    # Seeded synthetic closes (random walk around 100): the suite runs offline and is reproducible
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'ds': pd.date_range("2024-01-01", periods=100, freq='D'),
+        'y': 100 + np.cumsum(rng.normal(0, 1, 100)),
+        'unique_id': TICKER
+    })
+
+def fit_tiny(data, **config):
+    logger.info(f"🧪 Training tiny model for {TICKER} ({config})...")
+    model = NBEATS(**config, max_steps=1) # One step only
     nf = NeuralForecast(models=[model], freq='D')
     nf.fit(df=data)
-    
-    # 3. Save
-    save_path = os.path.join(MODELS_DIR, f"TEST_{ticker}_nbeats.pkl")
-    with open(save_path, 'wb') as f:
-        pickle.dump(nf, f)
-    
+    return nf
+
+@pytest.fixture(scope="session")
+def trained_model(sample_data):
+    # Trained once per session and shared by every test below
+    return fit_tiny(sample_data, **TEST_CONFIG)
+
+@pytest.fixture(scope="session")
+def identity_model(sample_data):
+    # Scaler of the committed MLE/models/*.pkl production models
+    return fit_tiny(sample_data, **{**TEST_CONFIG, 'scaler_type': 'identity'})
+
+def test_sample_data(sample_data):
+    assert list(sample_data.columns) == ['ds', 'y', 'unique_id']
+    assert len(sample_data) > TEST_CONFIG['input_size']
+
+@pytest.fixture(scope="session")
+def saved_checkpoint(trained_model, tmp_path_factory):
+    # Same checkpoint format as scripts/retrain.save_model, written once per session
+    save_path = str(tmp_path_factory.mktemp("models") / f"{TICKER}_nbeats.ckpt")
+    torch.save({'state_dict': trained_model.models[0].state_dict(), 'config': TEST_CONFIG}, save_path)
     logger.info(f"✅ Saved to {save_path}")
-    
-    # 4. Verify Load (Simulation of API)
+    return save_path
+
+def test_save_checkpoint(saved_checkpoint):
+    assert os.path.getsize(saved_checkpoint) > 0
+
+def test_load_checkpoint(trained_model, saved_checkpoint):
+    # Simulation of API (MLE/model_io.load_checkpoint)
+    loaded = load_checkpoint(saved_checkpoint)
+    for name, tensor in trained_model.models[0].state_dict().items():
+        assert torch.equal(loaded.state_dict()[name], tensor.cpu())
+    logger.info(f"✅ Loaded back successfully: {type(loaded)}")
+
+def test_pickle_roundtrip(trained_model, tmp_path):
+    # Legacy API format (CPU_Unpickler of the NeuralForecast wrapper)
+    save_path = tmp_path / f"{TICKER}_nbeats.pkl"
+    with open(save_path, 'wb') as f:
+        pickle.dump(trained_model, f)
+
     with open(save_path, 'rb') as f:
         loaded = pickle.load(f)
-    logger.info(f"✅ Loaded back successfully: {type(loaded)}")
+    assert isinstance(loaded, NeuralForecast)
+
+@pytest.mark.parametrize("model_fixture", ["trained_model", "identity_model"])
+def test_predict_window_matches_nf_predict(model_fixture, sample_data, request):
+    # Serving path (raw window in, price forecast out) must reproduce nf.predict, scaler included
+    nf = request.getfixturevalue(model_fixture)
+    expected = nf.predict(df=sample_data)['NBEATS'].to_numpy()
+
+    window = sample_data['y'].to_numpy()[-TEST_CONFIG['input_size']:]
+    insample_y = torch.tensor(window, dtype=torch.float32).view(1, -1, 1)
+    with torch.no_grad():
+        forecast = predict_window(nf.models[0].cpu().eval(), insample_y)
+    np.testing.assert_allclose(forecast.reshape(-1).numpy(), expected, rtol=1e-4, atol=1e-3)
+
+def test_torchscript_batch_parity(trained_model, tmp_path):
+    # The export must succeed (retrain ships it) and match eager at batch sizes other than the example's
+    core_model = trained_model.models[0].cpu().eval()
+    pt_path = str(tmp_path / "model.pt")
+    save_torchscript(core_model, pt_path)
+
+    served = load_torchscript(pt_path)
+    assert model_scaler_type(served) == TEST_CONFIG['scaler_type']
+    reference = quantize(core_model)
+    for batch_size in PARITY_BATCH_SIZES:
+        batch = example_batch(batch_size, input_size=TEST_CONFIG['input_size'])
+        with torch.no_grad():
+            forecast, expected = served(batch).reshape(batch_size, -1), reference(batch).reshape(batch_size, -1)
+        assert forecast.shape == (batch_size, TEST_CONFIG['h'])
+        assert (forecast - expected).abs().max().item() < 1e-4
+
+def test_onnx_batch_parity(trained_model, tmp_path):
+    # The export must succeed (retrain ships it) and match eager at batch sizes other than the example's
+    ort = pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnxscript")  # Required by the dynamo exporter
+    core_model = trained_model.models[0].cpu().eval()
+    onnx_path = str(tmp_path / "model.onnx")
+    save_onnx(core_model, onnx_path)
+
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    assert session.get_modelmeta().custom_metadata_map['scaler_type'] == TEST_CONFIG['scaler_type']
+    for batch_size in PARITY_BATCH_SIZES:
+        batch = example_batch(batch_size, input_size=TEST_CONFIG['input_size'])
+        feeds = dict(zip((node.name for node in session.get_inputs()),
+                         (batch[key].numpy() for key in ('insample_y', 'insample_mask'))))
+        with torch.no_grad():
+            expected = core_model(batch).reshape(batch_size, -1).numpy()
+        forecast = session.run(None, feeds)[0].reshape(batch_size, -1)
+        assert forecast.shape == (batch_size, TEST_CONFIG['h'])
+        assert abs(forecast - expected).max() < 1e-4
 
 if __name__ == "__main__":
-    test_pipeline()
+    sys.exit(pytest.main([__file__, "-q"]))